@@ -1,8 +1,5 @@
-from flask import Flask, g, redirect, render_template
-from sqlalchemy import extract
-from redis import Redis
+from flask import Flask, g, redirect, render_template, request
 
-from datetime import datetime
 import os
 
 from . import settings 
@@ -13,6 +10,52 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY = "dev",
         DATABASE = settings.DATABASE,
+        DATABASE_URL = settings.DATABASE_URL,
+        DB_POOL_SIZE = settings.DB_POOL_SIZE,
+        DB_MAX_OVERFLOW = settings.DB_MAX_OVERFLOW,
+        DB_POOL_TIMEOUT = settings.DB_POOL_TIMEOUT,
+        SQLITE_PRAGMAS = settings.SQLITE_PRAGMAS,
+        BROKER = settings.BROKER,
+        REDIS_HOST = settings.REDIS_HOST,
+        REDIS_PORT = settings.REDIS_PORT,
+        REDIS_DB = settings.REDIS_DB,
+        REDIS_POOL_SIZE = settings.REDIS_POOL_SIZE,
+        REDIS_POOL_TIMEOUT = settings.REDIS_POOL_TIMEOUT,
+        REDIS_SOCKET_TIMEOUT = settings.REDIS_SOCKET_TIMEOUT,
+        REDIS_SOCKET_CONNECT_TIMEOUT = settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        REDIS_HEALTH_CHECK_INTERVAL = settings.REDIS_HEALTH_CHECK_INTERVAL,
+        CURRENT_EVENT_TTL = settings.CURRENT_EVENT_TTL,
+        CURRENT_EVENT_REDIS_TTL = settings.CURRENT_EVENT_REDIS_TTL,
+        FEED_MAX_LENGTH = settings.FEED_MAX_LENGTH,
+        FEED_TTL = settings.FEED_TTL,
+        FEED_PAGE_SIZE = settings.FEED_PAGE_SIZE,
+        FEED_ARCHIVE_TTL = settings.FEED_ARCHIVE_TTL,
+        BROADCAST_QUEUE_SIZE = settings.BROADCAST_QUEUE_SIZE,
+        LIVE_BATCH_WINDOW = settings.LIVE_BATCH_WINDOW,
+        SSE_HEARTBEAT_INTERVAL = settings.SSE_HEARTBEAT_INTERVAL,
+        LIVE_UPDATE_MODE = settings.LIVE_UPDATE_MODE,
+        SOCKETIO_ASYNC_MODE = settings.SOCKETIO_ASYNC_MODE,
+        ANALYTICS_DAYS = settings.ANALYTICS_DAYS,
+        ARRIVAL_BUCKET_MINUTES = settings.ARRIVAL_BUCKET_MINUTES,
+        ANALYTICS_CACHE_TTL = settings.ANALYTICS_CACHE_TTL,
+        ADMIN_PAGE_SIZE = settings.ADMIN_PAGE_SIZE,
+        IMPORT_BATCH_SIZE = settings.IMPORT_BATCH_SIZE,
+        EVENT_DURATION = settings.EVENT_DURATION,
+        SCHEDULER_INTERVAL = settings.SCHEDULER_INTERVAL,
+        RUN_SCHEDULER = settings.RUN_SCHEDULER,
+        ATTENDANCE_WRITE_MODE = settings.ATTENDANCE_WRITE_MODE,
+        WRITE_BEHIND_BATCH_SIZE = settings.WRITE_BEHIND_BATCH_SIZE,
+        WRITE_BEHIND_CLAIM_IDLE = settings.WRITE_BEHIND_CLAIM_IDLE,
+        RUN_ATTENDANCE_WRITER = settings.RUN_ATTENDANCE_WRITER,
+        METRICS_ENABLED = settings.METRICS_ENABLED,
+        METRICS_TOKEN = settings.METRICS_TOKEN,
+        SLOW_QUERY_THRESHOLD = settings.SLOW_QUERY_THRESHOLD,
+        RATE_LIMIT_ENABLED = settings.RATE_LIMIT_ENABLED,
+        RATE_LIMIT_STUDENT = settings.RATE_LIMIT_STUDENT,
+        RATE_LIMIT_IP = settings.RATE_LIMIT_IP,
+        API_BATCH_SIZE = settings.API_BATCH_SIZE,
+        API_PAGE_SIZE = settings.API_PAGE_SIZE,
+        API_TOKEN_CACHE_TTL = settings.API_TOKEN_CACHE_TTL,
     )
 
     # Get configurations
@@ -21,18 +64,19 @@ def create_app(test_config=None):
     else:
         app.config.from_mapping(test_config)
 
-    # setup redis client
-    app.config["REDIS_HOST"] = settings.REDIS_HOST
-    app.config["REDIS_PORT"] = settings.REDIS_PORT
-    app.config["REDIS_DB"] = settings.REDIS_DB
-      
-    # attach redis_client to app
-    app.redis = Redis(
-            host = settings.REDIS_HOST,
-            port = settings.REDIS_PORT,
-            db = settings.REDIS_DB
+    # attach the broker (redis, or in-process with BROKER = "memory") to app,
+    # redis connections are opened on first use
+    from .broker import make_broker
+    app.broker = make_broker(app.config)
+
+    # one attendance-update subscription shared by the live streams of this process
+    from .broadcast import Broadcaster
+    from .feed import UPDATE_CHANNEL_PREFIX
+    app.broadcaster = Broadcaster(
+            app.broker, UPDATE_CHANNEL_PREFIX,
+            queue_size=app.config["BROADCAST_QUEUE_SIZE"],
+            batch_window=app.config["LIVE_BATCH_WINDOW"],
     )
-    app.redis.set('app-init', 'hello world')
     @app.route('/hello')
     
     def hello():
@@ -42,45 +86,51 @@ def create_app(test_config=None):
     from . import commands
     from . import db
    
+    from . import identity
+
     db.init_app(app)
     commands.init_app(app)
+    identity.init_app(app)
+
+    # async live updates
+    if app.config["LIVE_UPDATE_MODE"] == "socketio":
+        from . import sockets
+        sockets.init_app(app)
+
+    # open and close events in the background
+    if app.config["RUN_SCHEDULER"]:
+        from . import scheduler
+        scheduler.init_app(app)
+
+    # save write-behind attendance in the background
+    if app.config["RUN_ATTENDANCE_WRITER"]:
+        from . import writebehind
+        writebehind.init_app(app)
     
     from . import register
     from . import admin    
     from . import auth
+    from . import api
 
     app.register_blueprint(register.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(admin.bp)
+    app.register_blueprint(api.bp)
     
-    from .models import Event
-    from .db import db_session
+    from .events import get_current_event
+
+    # endpoints that never need the current event
+    SKIP_EVENT_LOOKUP = {'static', 'hello'}
 
     # setup current event if any
     @app.before_request
     def setup_event():
-        # check if event exists
-        # check if event is today
-        t = datetime.now()
-        if g.get('event') is not None:
-            # if current event is of previous day
-            # close current event
-            if g.event.date.month < t.month or g.event.day != t.day:
-                g.event.close()
-                db_session.add(g.event)
-                db_session.commit()
-
-        # if no event
-        # or event is closed
-        # check if any event for today exists that is not closed
-        if g.get('event') is None or g.event.closed == True:    
-            event = Event.query.filter(
-                    extract('day', Event.date) == t.day,
-                    extract('month', Event.date) == t.month,
-                    extract('year', Event.date) == t.year,
-                    Event.closed == False
-                ).first()
-            g.event = event  # returns None or Event object
+        if request.endpoint in SKIP_EVENT_LOOKUP:
+            g.event = None
+            return
+
+        # today's event that is not closed (None if no event)
+        g.event = get_current_event()
 
     @app.route('/')
     def home():
@@ -90,5 +140,16 @@ def create_app(test_config=None):
             return redirect('admin.dashboard')
         return render_template("home.html")
 
+    # turn away retry storms before any other request hook runs
+    if app.config["RATE_LIMIT_ENABLED"]:
+        from . import ratelimit
+        ratelimit.init_app(app)
+
+    # time requests, queries and broker calls, after the hooks above
+    # are registered so their queries are labelled with their names
+    if app.config["METRICS_ENABLED"]:
+        from . import metrics
+        metrics.init_app(app)
+
     return app
 
@@ -3,21 +3,33 @@ from flask import (
     render_template, session, 
     request, url_for, redirect,
     jsonify, Response, current_app,
-    stream_with_context
+    stream_with_context, send_file,
 )
 
 from werkzeug.security import check_password_hash
-from sqlalchemy import extract
 
 from .models import Student, Attendance, Event, Admin
 from .register import event_required
-from .db import db_session
+from .db import db_session, iter_rows
+from .identity import Identity, admin_identity
 from .utils import json_serialize
+from .events import invalidate_current_event
+from .feed import read_records, read_since, latest_id, unpack_update, id_key, split_closed
+from .broadcast import DROPPED
+from .export import export_query, iter_csv, write_xlsx
+from .stats import rankings as student_rankings, events_held
+from .analytics import dashboard_data
+from .history import event_page, attendance_page
+from .roster import import_students as import_roster
+from .metrics import observe_stream
 
 from collections import deque
 import functools
 import datetime
+import tempfile
+import time
 import json
+import io
 
 
 bp = Blueprint("admin", __name__, url_prefix='/admin')
@@ -34,11 +46,15 @@ def is_admin(view):
 
 @bp.before_app_request
 def load_admin():
-    admin_id = session.get("admin_id")
-    if admin_id is None:
-        g.admin = None
-    else:
-        g.admin = db_session.get(Admin, admin_id)
+    # identity is kept in the session, no query needed
+    identity = session.get("admin")
+    if identity is None and session.get("admin_id") is not None:
+        # session from before identities were stored, upgrade it
+        admin = db_session.get(Admin, session.pop("admin_id"))
+        if admin is not None:
+            identity = session['admin'] = admin_identity(admin)
+
+    g.admin = Identity(Admin, identity) if identity else None
 
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -61,7 +77,7 @@ def admin_login():
             g.student = None
             session.clear()
 
-            session['admin_id'] = admin.id
+            session['admin'] = admin_identity(admin)
             flash('logged In as Admin', 'success')
             return redirect(url_for('admin.dashboard'))
 
@@ -78,44 +94,88 @@ def admin_logout():
 @bp.route('/')
 @is_admin
 def dashboard():
-    return render_template('admin/board.html')
+    return render_template(
+        'admin/board.html',
+        live_connections=current_app.broadcaster.connection_count,
+        analytics=dashboard_data(),
+    )
 
 @bp.route('/live-attendance-update')
 @is_admin
 @event_required
 def get_live_attendance_update():
-    # TODO : use redis instead of deque
-    # TODO : implement a way of closing communication if event is closed for attendance
-
-    # add user to attendance-update channel
-    pubsub = current_app.redis.pubsub()
-    pubsub.subscribe('attendance-update')
-    timeout = 0  # forever keep redis connection open
+    # join this process's shared subscription to the event's updates
+    broadcaster = current_app.broadcaster
+    event_id = g.event.id
+    subscription = broadcaster.subscribe(event_id)
+
+    # records missed since the client's last seen record, read after
+    # subscribing so nothing published in between is lost
+    # (EventSource sends Last-Event-ID when it reconnects, the live page
+    # passes the newest record it rendered on the first connect)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    missed = read_since(event_id, last_event_id) if last_event_id else []
+
+    # the stream outlives the request and never touches the database,
+    # return the pooled connection now instead of holding it per viewer
+    db_session.remove()
     retry = 5 # retry to open connection after 5 secs
+    heartbeat = current_app.config["SSE_HEARTBEAT_INTERVAL"]
+
+    def frame(updates):
+        # one record as new_attendance, several as a new_attendance_batch
+        # array, records are stored as json already so they are joined as is
+        message = {}
+        message['id'] = updates[-1][0]
+        message['retry'] = retry
+        if len(updates) == 1:
+            message['event'] = 'new_attendance'
+            message['data'] = updates[0][1].decode()
+        else:
+            message['event'] = 'new_attendance_batch'
+            message['data'] = (b"[" + b",".join(record for _, record in updates) + b"]").decode()
+        return json_serialize(message)
 
     @stream_with_context
     def attendance_stream():
-        # infinite loop for stream
-        while True:
-            # listen for messages published on attendance-update channel
-            for pubsub_message in pubsub.listen():
-                # disregard subscribed and unsubscribed messages
-                message = {}
-                if pubsub_message['type'] == 'message':
-                    item = pubsub_message['data']
-             
-                    # get data dictionary
-                    data = json.loads(item)
-                    
-                    message['event'] = 'new_attendance'
-                    message['retry'] = retry
-                    message['data'] = data
-
-                    # make message a valid JSON data
-                    message = json_serialize(message)
-                    
-                    # send stream data
-                    yield message
+        opened = time.perf_counter()
+        try:
+            # send headers right away so the browser sees the stream open
+            yield f"retry:{retry}\n\n"
+
+            newest = None
+            if missed:
+                newest = missed[-1][0]
+                yield frame(missed)
+
+            while True:
+                item = subscription.get(timeout=heartbeat)
+                if item is None:
+                    # comment line, keeps proxies from closing an idle
+                    # connection and detects clients that went away
+                    yield ": heartbeat\n\n"
+                    continue
+                if item is DROPPED:
+                    # fell behind, the browser reconnects after retry
+                    # and replays from its last event id
+                    return
+
+                updates, closed = split_closed([unpack_update(update) for update in item])
+                if newest is not None:
+                    # skip records already sent while replaying
+                    updates = [u for u in updates if id_key(u[0]) > id_key(newest)]
+
+                # send stream data
+                if updates:
+                    yield frame(updates)
+                if closed:
+                    # the class closed, the page stops listening
+                    yield json_serialize({'event': 'closed', 'data': '{}', 'retry': None})
+                    return
+        finally:
+            # client disconnected or dropped
+            broadcaster.unsubscribe(event_id, subscription)
+            observe_stream(time.perf_counter() - opened)
     
     # create a response with event stream content type
     response = Response(attendance_stream(), mimetype='text/event-stream')
@@ -124,7 +184,7 @@ def get_live_attendance_update():
     response.headers['Cache-control'] = 'no-cache'
     response.headers['Connection'] = 'keep-alive'
     #response.headers['Content-Encoding'] = 'text/event-stream'
-    response.headers['X-Accel-Bufferring'] = 'no'
+    response.headers['X-Accel-Buffering'] = 'no'
 
     #return response
     return response
@@ -133,25 +193,53 @@ def get_live_attendance_update():
 @is_admin
 @event_required
 def live_attendance():
-    # check for seen attendance record
-    records = current_app.redis.lrange('seen', 0, -1)
-    # convert to list of dictionary
-    records = [json.loads(record) for record in records]
-    return render_template("admin/live_attendance.html", records=records)
+    # most recent attendance records, older ones are lazy loaded
+    records, cursor = read_records(g.event.id)
+    live_namespace = None
+    if current_app.config["LIVE_UPDATE_MODE"] == "socketio":
+        # flask_socketio is only installed and loaded for socket.io mode
+        from .sockets import NAMESPACE as live_namespace
+    return render_template(
+        "admin/live_attendance.html",
+        records=records,
+        cursor=cursor,
+        last_event_id=latest_id(g.event.id),
+        live_namespace=live_namespace,
+    )
+
+@bp.route('/live-attendance/rows')
+@is_admin
+@event_required
+def live_attendance_rows():
+    # page of older attendance records, requested by the live page
+    before = request.args.get('before')
+    if before is not None:
+        try:
+            id_key(before)
+        except ValueError:
+            # not a record id we handed out
+            return Response("Invalid cursor", 400)
+    records, cursor = read_records(g.event.id, before=before)
+    return render_template("admin/attendance_rows.html", records=records, cursor=cursor)
 
 @bp.route('/start_class')
 @is_admin
 def start_class():
-    if not g.event:
+    # a class scheduled for later today is not current yet but still clashes
+    scheduled = g.event or Event.query.filter(
+        Event.on_day(datetime.date.today()),
+        Event.closed == False,
+    ).first()
+    if not scheduled:
         t = datetime.datetime.now()
         admin = g.admin
 
         new_event = Event(date=t)
         new_event.created_by = g.admin.id
-        new_event.admin = g.admin
 
         db_session.add(new_event)
         db_session.commit()
+        invalidate_current_event()
         g.event = new_event
 
         flash(f"{new_event} Opened for attendance", "success")
@@ -182,19 +270,16 @@ def schedule_class():
         event_time = datetime.datetime(year, month, day, hour, minute)
         # check if an open event is scheduled for the same day, month and year
         # can only have an open event per day
-        clashing_event = Event.query.filter(
-                    extract('day', Event.date) == event_time.day,
-                    extract('month', Event.date) == event_time.month,
-                    extract('year', Event.date) == event_time.year
-                ).first()
+        clashing_event = Event.query.filter(Event.on_day(event_time.date())).first()
 
         if clashing_event:
             flash(f"Cannot schedule class for {event_time.strftime('%a %d, %b %Y')}, clashes with another", "error")
         else: 
             new_event = Event(event_time)
-            new_event.admin = g.admin
+            new_event.created_by = g.admin.id
             db_session.add(new_event)
             db_session.commit()
+            invalidate_current_event(event_time.date())
             flash(f"Added new class {new_event!r} to class schedules", "info")
             
             # make new event current event 
@@ -204,3 +289,110 @@ def schedule_class():
     else:
         return render_template('admin/schedule_class_form.html')
 
+
+@bp.route('/rankings')
+@is_admin
+def rankings():
+    # read from the precomputed student_stats table
+    return render_template(
+        'admin/rankings.html',
+        rankings=student_rankings(),
+        events_held=events_held(),
+    )
+
+
+@bp.route('/events')
+@is_admin
+def events():
+    # past and scheduled classes, older pages are lazy loaded by htmx
+    try:
+        page, cursor = event_page(request.args.get('cursor'), current_app.config["ADMIN_PAGE_SIZE"])
+    except ValueError:
+        flash("Invalid page", "error")
+        return redirect(url_for('admin.events'))
+    template = "admin/event_rows.html" if request.headers.get('HX-Request') else "admin/events.html"
+    return render_template(template, events=page, cursor=cursor, now=datetime.datetime.now())
+
+
+@bp.route('/events/<int:event_id>')
+@is_admin
+def event_attendance(event_id):
+    # a class's attendance in arrival order, later pages are lazy loaded by htmx
+    event = db_session.get(Event, event_id)
+    if event is None:
+        flash(f"No class with id {event_id}", "error")
+        return redirect(url_for('admin.events'))
+    try:
+        page, cursor = attendance_page(event_id, request.args.get('cursor'), current_app.config["ADMIN_PAGE_SIZE"])
+    except ValueError:
+        flash("Invalid page", "error")
+        return redirect(url_for('admin.event_attendance', event_id=event_id))
+    template = "admin/event_attendance_rows.html" if request.headers.get('HX-Request') else "admin/event_attendance.html"
+    return render_template(template, event=event, attendance_page=page, cursor=cursor)
+
+
+@bp.route('/students/import', methods=['GET', 'POST'])
+@is_admin
+def import_students():
+    report = None
+    if request.method == 'POST':
+        roster = request.files.get('roster')
+        if roster is None or not roster.filename:
+            flash("Select a roster csv file to import", "error")
+            return redirect(url_for('admin.import_students'))
+
+        # read the upload as it streams in rather than loading it whole
+        fileobj = io.TextIOWrapper(roster.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_roster(fileobj, batch_size=current_app.config["IMPORT_BATCH_SIZE"])
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f"Could not import roster: {e}", "error")
+            return redirect(url_for('admin.import_students'))
+
+    return render_template('admin/import_students.html', report=report)
+
+
+@bp.route('/export')
+@is_admin
+def export_attendance():
+    return render_template('admin/export_form.html')
+
+@bp.route('/export/download')
+@is_admin
+def export_download():
+    args = request.args
+    try:
+        start = args.get('start') or None
+        end = args.get('end') or None
+        stmt = export_query(
+            event_id=args.get('event_id', type=int),
+            start=datetime.date.fromisoformat(start) if start else None,
+            end=datetime.date.fromisoformat(end) if end else None,
+            department=args.get('department') or None,
+            level=args.get('level', type=int),
+        )
+    except ValueError:
+        flash("Dates should be in the form YYYY-MM-DD", "error")
+        return redirect(url_for('admin.export_attendance'))
+
+    filename = f"attendance-{datetime.date.today().isoformat()}"
+    if args.get('format') == 'xlsx':
+        # the workbook is assembled on disk, then streamed from there
+        fileobj = tempfile.TemporaryFile()
+        try:
+            write_xlsx(iter_rows(stmt), fileobj)
+        except RuntimeError as e:
+            fileobj.close()
+            flash(str(e), "error")
+            return redirect(url_for('admin.export_attendance'))
+        fileobj.seek(0)
+        return send_file(
+            fileobj,
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            as_attachment=True,
+            download_name=f"{filename}.xlsx",
+        )
+
+    response = Response(stream_with_context(iter_csv(iter_rows(stmt))), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
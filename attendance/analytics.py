@@ -0,0 +1,153 @@
+# attendance analytics for the admin dashboard
+#
+# figures are computed with grouped SQL aggregates per event, the summary
+# of an event that can no longer change (closed, or from an earlier day)
+# is cached on the broker, so a dashboard load only aggregates the open event
+
+from flask import current_app
+from sqlalchemy import select, func, extract
+
+from .models import Attendance, Event, Student
+from .db import db_session
+
+from collections import Counter
+from datetime import datetime, time, timedelta
+import json
+
+
+EVENT_SUMMARY_KEY = "analytics:event:{event_id}"
+
+# event ids per IN (...) clause
+_ID_CHUNK = 500
+
+
+def summary_key(event_id):
+    return EVENT_SUMMARY_KEY.format(event_id=event_id)
+
+
+def _is_final(event, today_start):
+    # attendance is only taken for today's open event
+    return event.closed or event.date < today_start
+
+
+def _empty_summary(event):
+    return {
+        'id': event.id,
+        'date': event.date.isoformat(),
+        'total': 0,
+        'departments': {},
+        'levels': {},
+        'arrivals': {},
+    }
+
+
+def _bucket(hour, minute, bucket_minutes):
+    minute = int(minute) // bucket_minutes * bucket_minutes
+    return f"{int(hour):02d}:{minute:02d}"
+
+
+def _aggregate(events):
+    """Computes the summaries of events with two grouped queries"""
+    summaries = {event.id: _empty_summary(event) for event in events}
+    bucket_minutes = current_app.config["ARRIVAL_BUCKET_MINUTES"]
+    ids = list(summaries)
+
+    for start in range(0, len(ids), _ID_CHUNK):
+        chunk = ids[start:start + _ID_CHUNK]
+
+        breakdown = (
+            select(Attendance.event_id, Student.department, Student.level, func.count())
+            .join(Student, Attendance.student_id == Student.id)
+            .where(Attendance.event_id.in_(chunk))
+            .group_by(Attendance.event_id, Student.department, Student.level)
+        )
+        for event_id, department, level, count in db_session.execute(breakdown):
+            summary = summaries[event_id]
+            summary['total'] += count
+            departments, levels = summary['departments'], summary['levels']
+            department = department or "Unknown"
+            level = str(level) if level is not None else "Unknown"
+            departments[department] = departments.get(department, 0) + count
+            levels[level] = levels.get(level, 0) + count
+
+        hour = extract('hour', Attendance.arrival_time)
+        minute = extract('minute', Attendance.arrival_time)
+        arrivals = (
+            select(Attendance.event_id, hour, minute, func.count())
+            .where(Attendance.event_id.in_(chunk))
+            .group_by(Attendance.event_id, hour, minute)
+        )
+        for event_id, h, m, count in db_session.execute(arrivals):
+            if h is None:
+                continue
+            buckets = summaries[event_id]['arrivals']
+            key = _bucket(h, m, bucket_minutes)
+            buckets[key] = buckets.get(key, 0) + count
+
+    return summaries
+
+
+def event_summaries(events):
+    """
+    Returns the summaries of events, in the order given
+
+    Cached summaries are read in one MGET, the rest are aggregated
+    together and those of final events are written back
+    """
+    if not events:
+        return []
+    broker = current_app.broker
+    today_start = datetime.combine(datetime.now().date(), time.min)
+
+    cached = broker.mget([summary_key(event.id) for event in events])
+    summaries = {}
+    missing = []
+    for event, data in zip(events, cached):
+        if data is None:
+            missing.append(event)
+        else:
+            summaries[event.id] = json.loads(data)
+
+    if missing:
+        computed = _aggregate(missing)
+        summaries.update(computed)
+        final = {
+            summary_key(event.id): json.dumps(computed[event.id])
+            for event in missing
+            if _is_final(event, today_start)
+        }
+        if final:
+            broker.set_many(final, ex=current_app.config["ANALYTICS_CACHE_TTL"])
+
+    return [summaries[event.id] for event in events]
+
+
+def dashboard_data(days=None):
+    """
+    Returns the dashboard figures of events held in the last days
+
+    (per event totals oldest first, the latest event's summary, and the
+    department, level and arrival breakdowns over the whole period)
+    """
+    days = days or current_app.config["ANALYTICS_DAYS"]
+    now = datetime.now()
+    events = db_session.execute(
+        select(Event.id, Event.date, Event.closed)
+        .where(Event.date >= now - timedelta(days=days), Event.date <= now)
+        .order_by(Event.date, Event.id)
+    ).all()
+    summaries = event_summaries(events)
+
+    departments, levels, arrivals = Counter(), Counter(), Counter()
+    for summary in summaries:
+        departments.update(summary['departments'])
+        levels.update(summary['levels'])
+        arrivals.update(summary['arrivals'])
+
+    return {
+        'events': [(s['date'][:10], s['total']) for s in summaries],
+        'latest': summaries[-1] if summaries else None,
+        'departments': departments.most_common(),
+        'levels': sorted(levels.items(), key=lambda item: item[0].zfill(4)),
+        'arrivals': sorted(arrivals.items()),
+    }
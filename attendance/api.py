@@ -0,0 +1,233 @@
+# json api for kiosks and scanners
+#
+# clients authenticate with "Authorization: Bearer <token>", tokens are
+# issued with `flask create-api-token`. Attendance can be marked one
+# reg_num at a time or in batches uploaded by offline kiosks, events and
+# an event's attendance are listed a page at a time with opaque cursors
+# (keyset pagination, see history.py)
+
+from flask import Blueprint, current_app, g, jsonify, request
+from sqlalchemy import select
+
+from .models import ApiToken, Event, Student
+from .db import db_session
+from .events import get_current_event
+from .history import event_page, attendance_page
+from .register import take_attendance
+from .validation import STUDENT_SCHEMA
+from .writebehind import is_marked
+
+from datetime import datetime
+import functools
+import time
+
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+# app.extensions entry caching verified tokens per app,
+# {digest: (expires_at, token name)}
+TOKEN_CACHE = "api_tokens"
+
+
+def _error(message, status):
+    return jsonify(error=message), status
+
+
+def _authenticate(token):
+    """Returns the name of a valid token, or None"""
+    digest = ApiToken.digest(token)
+    now = time.monotonic()
+    token_cache = current_app.extensions.setdefault(TOKEN_CACHE, {})
+    cached = token_cache.get(digest)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    stmt = select(ApiToken.name).where(ApiToken.token_hash == digest, ApiToken.revoked == False)
+    name = db_session.execute(stmt).scalar_one_or_none()
+    if name is None:
+        token_cache.pop(digest, None)
+        return None
+    token_cache[digest] = (now + current_app.config["API_TOKEN_CACHE_TTL"], name)
+    return name
+
+
+def token_required(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        g.api_client = _authenticate(token) if scheme == "Bearer" and token else None
+        if g.api_client is None:
+            return _error("A valid api token is required", 401)
+        return view(**kwargs)
+    return wrapped_view
+
+
+def _page_size():
+    limit = request.args.get("limit", type=int) or current_app.config["API_PAGE_SIZE"]
+    return max(1, min(limit, current_app.config["API_PAGE_SIZE"]))
+
+
+def _event_json(event):
+    return {"id": event.id, "date": event.date.isoformat(), "closed": event.closed}
+
+
+def _open_event(event_id):
+    """
+    Returns (event, error response) for today's open class, the only one
+    attendance is taken for (analytics caches the others' summaries as
+    final), event_id None means whichever class that is
+    """
+    event = get_current_event()
+    if event is not None and event_id in (None, event.id):
+        return event, None
+    if event_id is None:
+        return None, _error("No class is open for attendance", 409)
+    if db_session.get(Event, event_id) is None:
+        return None, _error(f"No class with id {event_id}", 404)
+    return None, _error(f"Class {event_id} is not open for attendance", 409)
+
+
+def _arrival_time(value, event, now):
+    """Parses a tap's ISO 8601 arrival time (local time unless it has an offset)"""
+    if not value:
+        return now
+    if not isinstance(value, str):
+        raise ValueError(f"arrival_time {value!r} is not an ISO 8601 string")
+    arrival_time = datetime.fromisoformat(value)
+    if arrival_time.tzinfo is not None:
+        arrival_time = arrival_time.astimezone().replace(tzinfo=None)
+    if arrival_time > now:
+        raise ValueError(f"arrival_time {value!r} is in the future")
+    if arrival_time.date() < event.date.date():
+        raise ValueError(f"arrival_time {value!r} is before the class")
+    return arrival_time
+
+
+def _students_by_reg_num(reg_nums, chunk_size=500):
+    students = {}
+    for start in range(0, len(reg_nums), chunk_size):
+        stmt = select(Student).where(Student.reg_num.in_(reg_nums[start:start + chunk_size]))
+        students.update((s.reg_num, s) for s in db_session.execute(stmt).scalars())
+    return students
+
+
+@bp.route("/attendance", methods=["POST"])
+@token_required
+def mark_attendance():
+    """Marks {"reg_num"} present at today's class"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return _error('Expected {"reg_num": ...}', 400)
+    try:
+        reg_num = STUDENT_SCHEMA.check("reg_num", data.get("reg_num"))
+    except ValueError as e:
+        return _error(str(e), 400)
+
+    event, error = _open_event(None)
+    if error:
+        return error
+    student = db_session.execute(select(Student).where(Student.reg_num == reg_num)).scalar_one_or_none()
+    if student is None:
+        return _error(f"No student with registration number {reg_num!r}", 404)
+
+    if is_marked(event.id, student.id) or not take_attendance(event.id, [(student, datetime.now())]):
+        return jsonify(reg_num=reg_num, event_id=event.id, status="already_taken"), 200
+    return jsonify(reg_num=reg_num, event_id=event.id, status="taken"), 201
+
+
+@bp.route("/attendance/batch", methods=["POST"])
+@token_required
+def mark_attendance_batch():
+    """
+    Marks a batch of taps, {"event_id": optional, "taps": [...]}
+
+    A tap is a reg_num, or {"reg_num", "arrival_time"} from a kiosk that
+    recorded it offline (ISO 8601, defaults to now). All taps are saved in
+    one transaction, the response counts them and lists the rejected ones.
+    """
+    data = request.get_json(silent=True)
+    taps = data.get("taps") if isinstance(data, dict) else None
+    if not isinstance(taps, list):
+        return _error('Expected {"taps": [...]}', 400)
+    if len(taps) > current_app.config["API_BATCH_SIZE"]:
+        return _error(f"At most {current_app.config['API_BATCH_SIZE']} taps per batch", 413)
+
+    event_id = data.get("event_id")
+    if event_id is not None and not isinstance(event_id, int):
+        return _error("event_id must be an integer", 400)
+    event, error = _open_event(event_id)
+    if error:
+        return error
+
+    now = datetime.now()
+    invalid = []
+    arrivals = {}  # reg_num: arrival time, the first tap of a student counts
+    for tap in taps:
+        if isinstance(tap, str):
+            tap = {"reg_num": tap}
+        if not isinstance(tap, dict):
+            invalid.append({"tap": tap, "error": "Expected a reg_num or an object"})
+            continue
+        try:
+            reg_num = STUDENT_SCHEMA.check("reg_num", tap.get("reg_num"))
+            arrival_time = _arrival_time(tap.get("arrival_time"), event, now)
+        except ValueError as e:
+            invalid.append({"tap": tap, "error": str(e)})
+            continue
+        if reg_num not in arrivals or arrival_time < arrivals[reg_num]:
+            arrivals[reg_num] = arrival_time
+
+    students = _students_by_reg_num(list(arrivals))
+    unknown = [reg_num for reg_num in arrivals if reg_num not in students]
+    taken = take_attendance(event.id, [
+        (students[reg_num], arrival_time)
+        for reg_num, arrival_time in arrivals.items()
+        if reg_num in students
+    ])
+    return jsonify(
+        event_id=event.id,
+        taken=len(taken),
+        already_taken=len(students) - len(taken),
+        unknown=unknown,
+        invalid=invalid,
+    )
+
+
+@bp.route("/events")
+@token_required
+def list_events():
+    """Events, most recent first, ?cursor= continues from the previous page"""
+    try:
+        events, next_cursor = event_page(request.args.get("cursor"), _page_size())
+    except ValueError:
+        return _error("Invalid cursor", 400)
+    return jsonify(
+        events=[dict(_event_json(event), attendance=event.attendance_count) for event in events],
+        next_cursor=next_cursor,
+    )
+
+
+@bp.route("/events/<int:event_id>/attendance")
+@token_required
+def event_attendance(event_id):
+    """An event's attendance in arrival order, ?cursor= continues from the previous page"""
+    event = db_session.get(Event, event_id)
+    if event is None:
+        return _error(f"No class with id {event_id}", 404)
+    try:
+        page, next_cursor = attendance_page(event_id, request.args.get("cursor"), _page_size())
+    except ValueError:
+        return _error("Invalid cursor", 400)
+
+    attendance = [
+        {
+            "reg_num": row.student.reg_num,
+            "firstname": row.student.firstname,
+            "lastname": row.student.lastname,
+            "department": row.student.department,
+            "level": row.student.level,
+            "arrival_time": row.arrival_time.isoformat(),
+        }
+        for row in page
+    ]
+    return jsonify(event=_event_json(event), attendance=attendance, next_cursor=next_cursor)
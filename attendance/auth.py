@@ -4,10 +4,13 @@ from flask import (
     request, url_for, redirect,
 )
 from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 
 from .models import Student, Attendance, Event
-from .utils import get_form_errors
+from .validation import STUDENT_SCHEMA
 from .db import db_session
+from .identity import Identity, IdentityGone, student_identity
+from .stats import student_stats, events_held
 
 import functools
 
@@ -26,11 +29,15 @@ def login_required(view):
 
 @bp.before_app_request
 def load_student():
-    student_id = session.get("student_id")
-    if student_id is None:
-        g.student = None
-    else:
-        g.student = db_session.get(Student, student_id)
+    # identity is kept in the session, no query needed
+    identity = session.get("student")
+    if identity is None and session.get("student_id") is not None:
+        # session from before identities were stored, upgrade it
+        student = db_session.get(Student, session.pop("student_id"))
+        if student is not None:
+            identity = session['student'] = student_identity(student)
+
+    g.student = Identity(Student, identity) if identity else None
 
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -47,7 +54,7 @@ def login():
             return redirect(url_for('register.enroll', reg_num=reg_num.replace('/', '_')))
         else:
             session.clear()
-            session['student_id'] = stud.id
+            session['student'] = student_identity(stud)
             return redirect(url_for('auth.profile'))
             
     return render_template("auth/reg_number_form.html")
@@ -55,29 +62,41 @@ def login():
 @bp.route('/profile')
 @login_required
 def profile():
-    return render_template("auth/profile.html")
+    return render_template(
+        "auth/profile.html",
+        stats=student_stats(g.student.id),
+        events_held=events_held(),
+    )
 
 @bp.route('/edit', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     if request.method == "POST":
-        form = request.form
-        errors = get_form_errors(form)
-        if errors is not None:
-            reg_num = form.get('reg_num')
-            student = Student.query.filter(Student.reg_num == reg_num).first()
-            if student is not None:
-                update_stmt = (
-                    update(Student)
-                    .where(Student.reg_num == reg_num)
-                    .values(**form)        
-                )
+        # cleaned values of the schema's fields, other form fields are ignored
+        values, errors = STUDENT_SCHEMA.validate(request.form)
+        if not errors:
+            # update by primary key, the unique index on reg_num
+            # rejects a reg_num that belongs to another student
+            update_stmt = (
+                update(Student)
+                .where(Student.id == g.student.id)
+                .values(**values)
+            )
+            try:
                 db_session.execute(update_stmt)
                 db_session.commit()
-                return redirect(url_for('auth.profile')) 
-            else:   
-                error = f"No student with registration number {reg_num!r} was registered"
-        flash(error, 'error')
+            except IntegrityError:
+                db_session.rollback()
+                errors = [f"A student is already enrolled with registration number {values['reg_num']!r}"]
+            else:
+                # refresh the identity kept in the session
+                student = db_session.get(Student, g.student.id)
+                if student is None:
+                    raise IdentityGone(Student)
+                session['student'] = student_identity(student)
+                return redirect(url_for('auth.profile'))
+        for error in errors:
+            flash(error, 'error')
         return redirect(url_for('auth.edit_profile'))
     
     return render_template('auth/edit_profile.html')
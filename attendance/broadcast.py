@@ -0,0 +1,157 @@
+# fan out live attendance updates to the streams connected to this process
+
+from .broker import BrokerError
+
+import logging
+import queue
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# put on a client's queue when it has been dropped
+DROPPED = object()
+
+
+class Subscription:
+    """A connected client's queue of update lists"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout=None):
+        """
+        Blocks for the next list of updates, returns None on timeout and
+        DROPPED once the client has been dropped for falling behind
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broadcaster:
+    """
+    Holds one broker subscription per process and fans its messages out
+    to in-memory client queues
+
+    Updates are published per event on "<prefix>:<event_id>" channels and
+    reach the clients subscribed to that event, listeners (such as the
+    socket.io forwarder) receive every update. Clients and listeners get
+    lists of updates, with a batch_window (seconds) the updates received
+    within the window are delivered as one list.
+
+    The listening thread is started by the first client or listener, a
+    client whose queue fills up (a stalled connection) is dropped instead
+    of holding messages in memory, browsers reconnect on their own
+    """
+
+    def __init__(self, broker, prefix, queue_size=256, batch_window=0):
+        self.broker = broker
+        self.prefix = prefix
+        self.queue_size = queue_size
+        self.batch_window = batch_window
+        self._clients = {}  # event_id: set of subscriptions
+        self._listeners = []
+        self._pending = {}  # event_id: updates waiting for the batch window
+        self._lock = threading.Lock()
+        self._thread = None
+        self._flusher = None
+
+    @property
+    def connection_count(self):
+        """Number of clients currently connected to this process"""
+        return sum(len(clients) for clients in self._clients.values())
+
+    def subscribe(self, event_id):
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._clients.setdefault(event_id, set()).add(subscription)
+            self._start()
+        return subscription
+
+    def unsubscribe(self, event_id, subscription):
+        with self._lock:
+            clients = self._clients.get(event_id, set())
+            clients.discard(subscription)
+            if not clients:
+                self._clients.pop(event_id, None)
+
+    def add_listener(self, listener):
+        """Calls listener(event_id, updates) for every batch of updates"""
+        with self._lock:
+            self._listeners.append(listener)
+            self._start()
+
+    def fan_out(self, event_id, data):
+        """Delivers an update now, or with the next batch when batching"""
+        if not self.batch_window:
+            self._deliver(event_id, [data])
+            return
+        with self._lock:
+            self._pending.setdefault(event_id, []).append(data)
+
+    def _deliver(self, event_id, updates):
+        with self._lock:
+            clients = list(self._clients.get(event_id, ()))
+            listeners = list(self._listeners)
+        for subscription in clients:
+            try:
+                subscription.queue.put_nowait(updates)
+            except queue.Full:
+                self._drop(event_id, subscription)
+        for listener in listeners:
+            listener(event_id, updates)
+
+    def _flush(self):
+        while True:
+            time.sleep(self.batch_window)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for event_id, updates in pending.items():
+                self._deliver(event_id, updates)
+
+    def _drop(self, event_id, subscription):
+        self.unsubscribe(event_id, subscription)
+        with subscription.queue.mutex:
+            subscription.queue.queue.clear()
+        subscription.queue.put_nowait(DROPPED)
+        logger.warning("Dropped a live attendance client that fell behind")
+
+    def _start(self):
+        # called with the lock held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._listen, name=f"broadcaster-{self.prefix}", daemon=True
+            )
+            self._thread.start()
+        if self.batch_window and (self._flusher is None or not self._flusher.is_alive()):
+            self._flusher = threading.Thread(
+                target=self._flush, name=f"broadcaster-{self.prefix}-flush", daemon=True
+            )
+            self._flusher.start()
+
+    def _listen(self):
+        pattern = f"{self.prefix}:*"
+        # reconnect with a short backoff if the broker goes away
+        while True:
+            try:
+                subscription = self.broker.psubscribe(pattern)
+            except BrokerError:
+                logger.exception("Could not subscribe to %r, retrying", pattern)
+                time.sleep(1)
+                continue
+            try:
+                while True:
+                    message = subscription.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    channel, data = message
+                    event_id = int(channel.decode().rsplit(':', 1)[1])
+                    self.fan_out(event_id, data)
+            except BrokerError:
+                logger.exception("Lost subscription to %r, reconnecting", pattern)
+                time.sleep(1)
+            finally:
+                subscription.close()
@@ -0,0 +1,607 @@
+# message broker behind the live feed, caches, locks and queues
+#
+# the app talks to app.broker, a RedisBroker by default. A MemoryBroker
+# keeps everything in the process instead, for single process deployments,
+# tests and benchmarks that should not need a redis server
+# (BROKER = "memory"). Both return bytes as redis-py does.
+
+from redis import Redis, BlockingConnectionPool
+from redis.exceptions import (
+    ConnectionError as RedisConnectionError,
+    TimeoutError as RedisTimeoutError,
+    ResponseError,
+)
+
+from fnmatch import fnmatchcase
+import abc
+import queue
+import threading
+import time
+
+
+class BrokerError(Exception):
+    """The broker connection was lost"""
+
+
+class Broker(abc.ABC):
+    """
+    Operations the app needs from a broker
+
+    Values and stream ids come back as bytes, as redis-py returns them.
+    Scripts run a lua script atomically, brokers without lua run its
+    python fallback(broker, keys, args) instead.
+    """
+
+    @abc.abstractmethod
+    def ping(self):
+        """Checks the broker is reachable"""
+
+    # key/value
+
+    @abc.abstractmethod
+    def get(self, key):
+        """Returns the value of key or None"""
+
+    @abc.abstractmethod
+    def set(self, key, value, ex=None, px=None, nx=False):
+        """Sets key, expiring after ex seconds or px ms, only if missing with nx, returns whether it was set"""
+
+    @abc.abstractmethod
+    def mget(self, keys):
+        """Returns the values of keys, None for missing ones"""
+
+    @abc.abstractmethod
+    def set_many(self, mapping, ex=None):
+        """Sets every key of mapping in one round trip"""
+
+    @abc.abstractmethod
+    def delete(self, *keys):
+        """Deletes keys, returns the number that existed"""
+
+    @abc.abstractmethod
+    def exists(self, key):
+        """Returns 1 if key exists, else 0"""
+
+    @abc.abstractmethod
+    def rename(self, src, dst):
+        """Moves src to dst, with its expiry"""
+
+    @abc.abstractmethod
+    def expire(self, key, seconds):
+        """Expires key after seconds, returns whether it exists"""
+
+    @abc.abstractmethod
+    def incr(self, key, amount=1, ex=None):
+        """Adds amount to key, ex starts its expiry on the first increment, returns the new value"""
+
+    # sets
+
+    @abc.abstractmethod
+    def sadd(self, key, *members):
+        """Adds members to the set at key, returns the number that were new"""
+
+    @abc.abstractmethod
+    def sismember(self, key, member):
+        """Whether member is in the set at key"""
+
+    # pub/sub
+
+    @abc.abstractmethod
+    def publish(self, channel, data):
+        """Sends data to the subscribers of channel, returns how many got it"""
+
+    @abc.abstractmethod
+    def psubscribe(self, pattern):
+        """Returns a subscription to the channels matching pattern"""
+
+    # streams
+
+    @abc.abstractmethod
+    def xadd(self, key, fields, maxlen=None):
+        """Appends fields to the stream at key, capped at about maxlen entries, returns the entry id"""
+
+    @abc.abstractmethod
+    def xrange(self, key, min="-", max="+", count=None):
+        """Returns [(id, fields)] between min and max, oldest first"""
+
+    @abc.abstractmethod
+    def xrevrange(self, key, max="+", min="-", count=None):
+        """Returns [(id, fields)] between max and min, newest first"""
+
+    @abc.abstractmethod
+    def xlen(self, key):
+        """Number of entries in the stream at key"""
+
+    @abc.abstractmethod
+    def group_create(self, key, group):
+        """Creates a consumer group reading key from the start (if missing)"""
+
+    @abc.abstractmethod
+    def group_read(self, key, group, consumer, last_id=">", count=None, block=None):
+        """
+        Returns [(id, fields)] read by consumer, ">" reads new entries,
+        "0" the consumer's entries read but not acknowledged
+        """
+
+    @abc.abstractmethod
+    def group_ack(self, key, group, ids):
+        """Acknowledges and deletes entries"""
+
+    @abc.abstractmethod
+    def group_claim(self, key, group, consumer, min_idle_ms, start="0-0", count=None):
+        """
+        Hands entries pending for min_idle_ms to consumer, returns
+        (next start, entries), next start is "0-0" after the last page
+        """
+
+    # scripts
+
+    @abc.abstractmethod
+    def script(self, source, fallback):
+        """Returns a callable(keys, args) running the lua script source, or fallback"""
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get_message(self, timeout=1.0):
+        """Returns (channel, data) or None after timeout seconds"""
+        try:
+            message = self.pubsub.get_message(timeout=timeout)
+        except (RedisConnectionError, RedisTimeoutError) as e:
+            raise BrokerError(str(e)) from e
+        if message is None or message['type'] not in ('message', 'pmessage'):
+            return None
+        return message['channel'], message['data']
+
+    def close(self):
+        self.pubsub.close()
+
+
+class RedisBroker(Broker):
+    """Broker backed by a redis server"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def ping(self):
+        return self.redis.ping()
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        return bool(self.redis.set(key, value, ex=ex, px=px, nx=nx))
+
+    def mget(self, keys):
+        return self.redis.mget(keys)
+
+    def set_many(self, mapping, ex=None):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, value, ex=ex)
+        pipe.execute()
+
+    def delete(self, *keys):
+        return self.redis.delete(*keys) if keys else 0
+
+    def exists(self, key):
+        return self.redis.exists(key)
+
+    def rename(self, src, dst):
+        return self.redis.rename(src, dst)
+
+    def expire(self, key, seconds):
+        return self.redis.expire(key, seconds)
+
+    def incr(self, key, amount=1, ex=None):
+        value = self.redis.incrby(key, amount)
+        if ex and value == amount:
+            # first increment, start the window
+            self.redis.expire(key, ex)
+        return value
+
+    def sadd(self, key, *members):
+        return self.redis.sadd(key, *members)
+
+    def sismember(self, key, member):
+        return bool(self.redis.sismember(key, member))
+
+    def publish(self, channel, data):
+        return self.redis.publish(channel, data)
+
+    def psubscribe(self, pattern):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.psubscribe(pattern)
+        except (RedisConnectionError, RedisTimeoutError) as e:
+            pubsub.close()
+            raise BrokerError(str(e)) from e
+        return RedisSubscription(pubsub)
+
+    def xadd(self, key, fields, maxlen=None):
+        return self.redis.xadd(key, fields, maxlen=maxlen, approximate=True)
+
+    def xrange(self, key, min="-", max="+", count=None):
+        return self.redis.xrange(key, min, max, count=count)
+
+    def xrevrange(self, key, max="+", min="-", count=None):
+        return self.redis.xrevrange(key, max, min, count=count)
+
+    def xlen(self, key):
+        return self.redis.xlen(key)
+
+    def group_create(self, key, group):
+        try:
+            self.redis.xgroup_create(key, group, id="0", mkstream=True)
+        except ResponseError as e:
+            # BUSYGROUP, created earlier
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def group_read(self, key, group, consumer, last_id=">", count=None, block=None):
+        response = self.redis.xreadgroup(group, consumer, {key: last_id}, count=count, block=block)
+        return response[0][1] if response else []
+
+    def group_ack(self, key, group, ids):
+        pipe = self.redis.pipeline()
+        pipe.xack(key, group, *ids)
+        pipe.xdel(key, *ids)
+        pipe.execute()
+
+    def group_claim(self, key, group, consumer, min_idle_ms, start="0-0", count=None):
+        next_start, entries, *_ = self.redis.xautoclaim(
+            key, group, consumer, min_idle_ms, start_id=start, count=count
+        )
+        return next_start, entries
+
+    def script(self, source, fallback):
+        script = self.redis.register_script(source)
+        return lambda keys=(), args=(): script(keys=keys, args=args)
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    return str(value).encode()
+
+
+def _parse_id(stream_id, default_seq=0):
+    if isinstance(stream_id, bytes):
+        stream_id = stream_id.decode()
+    if stream_id == "-":
+        return (0, 0)
+    if stream_id == "+":
+        return (float("inf"), float("inf"))
+    ms, _, seq = stream_id.partition("-")
+    return (int(ms), int(seq) if seq else default_seq)
+
+
+class _Stream:
+    def __init__(self):
+        self.entries = []  # [(id key, id, fields)] oldest first
+        self.groups = {}  # name: {'last': id key, 'pending': {id: [consumer, delivered_at]}}
+
+    def find(self, entry_id):
+        for key, stored_id, fields in self.entries:
+            if stored_id == entry_id:
+                return fields
+        return None
+
+
+class MemorySubscription:
+    def __init__(self, broker, pattern):
+        self.broker = broker
+        self.pattern = pattern
+        self.queue = queue.Queue()
+
+    def get_message(self, timeout=1.0):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+class MemoryBroker(Broker):
+    """
+    Broker keeping its data in this process
+
+    Only clients in the same process share it, so run a single app
+    process with it (and the scheduler and attendance writer as threads).
+    Operations take a lock, scripts run their fallback under it.
+
+    An expired key is dropped when it is next read, and writes sweep out
+    every expired key at most once per sweep_interval seconds, so keys
+    that are never read again (rate limit buckets, old feeds) do not pile up.
+    """
+
+    sweep_interval = 1.0
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._data = {}
+        self._expires = {}  # key: monotonic deadline
+        self._next_sweep = 0.0
+        self._subscriptions = []
+        self._last_id = (0, 0)
+
+    def _sweep(self):
+        # called with the lock held by operations that write
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        expired = [key for key, deadline in self._expires.items() if deadline <= now]
+        for key in expired:
+            del self._expires[key]
+            self._data.pop(key, None)
+
+    def _get(self, key, kind=None):
+        # called with the lock held, drops the key once expired
+        key = _encode(key)
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        value = self._data.get(key)
+        if kind is not None and value is not None and not isinstance(value, kind):
+            raise TypeError(f"{key!r} holds the wrong kind of value")
+        return value
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key, bytes)
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        with self._lock:
+            self._sweep()
+            if nx and self._get(key) is not None:
+                return False
+            key = _encode(key)
+            self._data[key] = _encode(value)
+            self._expires.pop(key, None)
+            if ex or px:
+                self._expires[key] = time.monotonic() + (ex if ex else px / 1000)
+            return True
+
+    def mget(self, keys):
+        with self._lock:
+            return [self._get(key, bytes) for key in keys]
+
+    def set_many(self, mapping, ex=None):
+        with self._lock:
+            for key, value in mapping.items():
+                self.set(key, value, ex=ex)
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                if self._get(key) is not None:
+                    deleted += 1
+                self._data.pop(_encode(key), None)
+                self._expires.pop(_encode(key), None)
+            return deleted
+
+    def exists(self, key):
+        with self._lock:
+            return int(self._get(key) is not None)
+
+    def rename(self, src, dst):
+        with self._lock:
+            self._sweep()
+            value = self._get(src)
+            if value is None:
+                raise KeyError(src)
+            deadline = self._expires.pop(_encode(src), None)
+            self.delete(src, dst)
+            self._data[_encode(dst)] = value
+            if deadline is not None:
+                self._expires[_encode(dst)] = deadline
+            return True
+
+    def expire(self, key, seconds):
+        with self._lock:
+            self._sweep()
+            if self._get(key) is None:
+                return False
+            self._expires[_encode(key)] = time.monotonic() + int(seconds)
+            return True
+
+    def incr(self, key, amount=1, ex=None):
+        with self._lock:
+            self._sweep()
+            value = int(self._get(key, bytes) or 0) + amount
+            deadline = self._expires.get(_encode(key))
+            self._data[_encode(key)] = _encode(value)
+            if ex and value == amount:
+                self._expires[_encode(key)] = time.monotonic() + ex
+            elif deadline is not None:
+                self._expires[_encode(key)] = deadline
+            return value
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._sweep()
+            members = {_encode(member) for member in members}
+            stored = self._get(key, set)
+            if stored is None:
+                stored = self._data[_encode(key)] = set()
+            added = len(members - stored)
+            stored.update(members)
+            return added
+
+    def sismember(self, key, member):
+        with self._lock:
+            return _encode(member) in (self._get(key, set) or ())
+
+    def publish(self, channel, data):
+        channel, data = _encode(channel), _encode(data)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        receivers = 0
+        for subscription in subscriptions:
+            if fnmatchcase(channel.decode(), subscription.pattern):
+                subscription.queue.put((channel, data))
+                receivers += 1
+        return receivers
+
+    def psubscribe(self, pattern):
+        subscription = MemorySubscription(self, pattern)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def _stream(self, key, create=False):
+        stream = self._get(key, _Stream)
+        if stream is None and create:
+            stream = self._data[_encode(key)] = _Stream()
+        return stream
+
+    def xadd(self, key, fields, maxlen=None):
+        with self._lock:
+            self._sweep()
+            stream = self._stream(key, create=True)
+            ms = int(time.time() * 1000)
+            last_ms, last_seq = self._last_id
+            entry_key = (ms, 0) if ms > last_ms else (last_ms, last_seq + 1)
+            self._last_id = entry_key
+            entry_id = f"{entry_key[0]}-{entry_key[1]}".encode()
+            stream.entries.append((entry_key, entry_id, {_encode(k): _encode(v) for k, v in fields.items()}))
+            if maxlen is not None and len(stream.entries) > int(maxlen):
+                del stream.entries[:len(stream.entries) - int(maxlen)]
+            self._changed.notify_all()
+            return entry_id
+
+    def xrange(self, key, min="-", max="+", count=None):
+        with self._lock:
+            stream = self._stream(key)
+            if stream is None:
+                return []
+            low, high = _parse_id(min), _parse_id(max, default_seq=float("inf"))
+            entries = [(i, dict(f)) for k, i, f in stream.entries if low <= k <= high]
+            return entries[:count] if count else entries
+
+    def xrevrange(self, key, max="+", min="-", count=None):
+        with self._lock:
+            entries = self.xrange(key, min, max)[::-1]
+            return entries[:count] if count else entries
+
+    def xlen(self, key):
+        with self._lock:
+            stream = self._stream(key)
+            return len(stream.entries) if stream else 0
+
+    def group_create(self, key, group):
+        with self._lock:
+            self._sweep()
+            stream = self._stream(key, create=True)
+            stream.groups.setdefault(group, {'last': (0, 0), 'pending': {}})
+
+    def group_read(self, key, group, consumer, last_id=">", count=None, block=None):
+        deadline = time.monotonic() + block / 1000 if block else None
+        with self._lock:
+            while True:
+                stream = self._stream(key)
+                if stream is None or group not in stream.groups:
+                    raise ResponseError(f"NOGROUP No such consumer group {group!r} for key {key!r}")
+                state = stream.groups[group]
+
+                if last_id != ">":
+                    # this consumer's pending entries
+                    after = _parse_id(last_id)
+                    pending = sorted(
+                        (_parse_id(i), i) for i, (c, _) in state['pending'].items()
+                        if c == consumer and _parse_id(i) > after
+                    )
+                    entries = [(i, stream.find(i)) for _, i in pending]
+                    return entries[:count] if count else entries
+
+                entries = [(k, i, f) for k, i, f in stream.entries if k > state['last']]
+                if count:
+                    entries = entries[:count]
+                if entries:
+                    state['last'] = entries[-1][0]
+                    now = time.monotonic()
+                    for _, i, _ in entries:
+                        state['pending'][i] = [consumer, now]
+                    return [(i, dict(f)) for _, i, f in entries]
+
+                remaining = deadline - time.monotonic() if deadline else 0
+                if remaining <= 0:
+                    return []
+                self._changed.wait(remaining)
+
+    def group_ack(self, key, group, ids):
+        with self._lock:
+            stream = self._stream(key)
+            if stream is None:
+                return
+            ids = {_encode(i) for i in ids}
+            pending = stream.groups.get(group, {}).get('pending', {})
+            for i in ids:
+                pending.pop(i, None)
+            stream.entries = [entry for entry in stream.entries if entry[1] not in ids]
+
+    def group_claim(self, key, group, consumer, min_idle_ms, start="0-0", count=None):
+        with self._lock:
+            stream = self._stream(key)
+            if stream is None or group not in stream.groups:
+                return b"0-0", []
+            pending = stream.groups[group]['pending']
+            now = time.monotonic()
+            after = _parse_id(start)
+            claimed = sorted(
+                (_parse_id(i), i) for i, (_, delivered) in pending.items()
+                if _parse_id(i) >= after and (now - delivered) * 1000 >= min_idle_ms
+            )
+            if count:
+                claimed = claimed[:count]
+            entries = []
+            for _, i in claimed:
+                pending[i] = [consumer, now]
+                entries.append((i, stream.find(i)))
+            return b"0-0", entries
+
+    def script(self, source, fallback):
+        def run(keys=(), args=()):
+            with self._lock:
+                return fallback(self, list(keys), list(args))
+        return run
+
+
+def make_broker(config):
+    """Returns the broker named by config["BROKER"] ("redis" or "memory")"""
+    if config["BROKER"] == "memory":
+        return MemoryBroker()
+    if config["BROKER"] != "redis":
+        raise ValueError(f"Unknown BROKER {config['BROKER']!r}, use 'redis' or 'memory'")
+
+    # requests wait up to REDIS_POOL_TIMEOUT for a free connection
+    # instead of opening connections without bound
+    pool = BlockingConnectionPool(
+        host=config["REDIS_HOST"],
+        port=config["REDIS_PORT"],
+        db=config["REDIS_DB"],
+        max_connections=config["REDIS_POOL_SIZE"],
+        timeout=config["REDIS_POOL_TIMEOUT"],
+        socket_timeout=config["REDIS_SOCKET_TIMEOUT"],
+        socket_connect_timeout=config["REDIS_SOCKET_CONNECT_TIMEOUT"],
+        health_check_interval=config["REDIS_HEALTH_CHECK_INTERVAL"],
+    )
+    return RedisBroker(Redis(connection_pool=pool))
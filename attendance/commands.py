@@ -1,11 +1,19 @@
+from flask import current_app
+from flask.cli import with_appcontext
 from werkzeug.security import generate_password_hash
 import click
 
-from .db import init_db, db_session
-from .models import Admin
+from .db import init_db, db_session, iter_rows
+from .models import Admin, ApiToken
+from .export import export_query, iter_csv, write_xlsx
+from .stats import rebuild_stats
+from .roster import import_students, write_error_report
+from .scheduler import Scheduler
+from .writebehind import AttendanceWriter
 from . import settings
 
 import getpass
+import io
 import os
 
 db_path = settings.DATABASE
@@ -62,6 +70,136 @@ def create_admin_command():
     """Create an admin"""
     create_admin()
 
+@click.command('export-attendance')
+@click.option('--event-id', type=int, help="Only this class")
+@click.option('--start', type=click.DateTime(formats=["%Y-%m-%d"]), help="Classes from this date")
+@click.option('--end', type=click.DateTime(formats=["%Y-%m-%d"]), help="Classes up to this date")
+@click.option('--department', help="Only students of this department")
+@click.option('--level', type=int, help="Only students of this level")
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'xlsx']), default='csv')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="File to write (csv defaults to stdout)")
+def export_attendance_command(event_id, start, end, department, level, fmt, output):
+    """Export attendance records"""
+    stmt = export_query(
+        event_id=event_id,
+        start=start.date() if start else None,
+        end=end.date() if end else None,
+        department=department,
+        level=level,
+    )
+    rows = iter_rows(stmt)
+
+    if fmt == 'xlsx':
+        if output is None:
+            raise click.UsageError("--output is required for xlsx exports")
+        try:
+            write_xlsx(rows, output)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+    else:
+        with click.open_file(output or '-', 'w') as f:
+            for chunk in iter_csv(rows):
+                f.write(chunk)
+
+@click.command('rebuild-stats')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help="Summaries inserted per statement")
+def rebuild_stats_command(batch_size):
+    """Recompute student attendance statistics"""
+    count = rebuild_stats(batch_size=batch_size)
+    click.echo(f"Rebuilt statistics of {count} students")
+
+@click.command('import-students')
+@click.argument('roster', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--batch-size', type=int, help="Rows validated and inserted per transaction (defaults to IMPORT_BATCH_SIZE)")
+@click.option('--errors', type=click.Path(dir_okay=False), help="File to write rejected rows to (defaults to stderr)")
+def import_students_command(roster, batch_size, errors):
+    """Enroll the students listed in a roster csv"""
+    batch_size = batch_size or current_app.config["IMPORT_BATCH_SIZE"]
+    # the csv module needs newline='' to read quoted fields that span
+    # lines, click.open_file cannot pass it
+    if roster == '-':
+        f = io.TextIOWrapper(click.get_binary_stream('stdin'), encoding='utf-8-sig', newline='')
+    else:
+        f = open(roster, encoding='utf-8-sig', newline='')
+    with f:
+        try:
+            report = import_students(f, batch_size=batch_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    if report.errors:
+        if errors:
+            with open(errors, 'w', newline='') as out:
+                write_error_report(report, out)
+        else:
+            write_error_report(report, click.get_text_stream('stderr'))
+    click.echo(report.summary())
+
+@click.command('run-scheduler')
+@click.option('--interval', type=float, help="Seconds between rounds (defaults to SCHEDULER_INTERVAL)")
+@click.option('--once', is_flag=True, help="Run a single round and exit")
+@with_appcontext
+def run_scheduler_command(interval, once):
+    """Open and close classes on schedule"""
+    scheduler = Scheduler(current_app._get_current_object(), interval=interval)
+    if once:
+        opened, closed = scheduler.tick()
+        click.echo(f"Opened {len(opened)} and closed {len(closed)} classes")
+        return
+    click.echo(f"Scheduler running every {scheduler.interval}s, press CTRL+C to quit")
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+@click.command('run-attendance-writer')
+@click.option('--batch-size', type=int, help="Taps saved per transaction (defaults to WRITE_BEHIND_BATCH_SIZE)")
+@click.option('--consumer', help="Writer name, a restarted writer replays the taps it left unsaved")
+@click.option('--once', is_flag=True, help="Save the queued taps and exit")
+@with_appcontext
+def run_attendance_writer_command(batch_size, consumer, once):
+    """Save taps queued in write-behind mode to the database"""
+    writer = AttendanceWriter(current_app._get_current_object(), consumer=consumer, batch_size=batch_size)
+    if once:
+        saved = writer.flush()
+        click.echo(f"Saved {saved} attendance records")
+        return
+    click.echo(f"Attendance writer {writer.consumer!r} running, press CTRL+C to quit")
+    try:
+        writer.run()
+    except KeyboardInterrupt:
+        writer.stop()
+
+@click.command('create-api-token')
+@click.argument('name')
+def create_api_token_command(name):
+    """Issue a json api token for a kiosk or scanner"""
+    if ApiToken.query.filter(ApiToken.name == name).first() is not None:
+        raise click.ClickException(f"An api token named {name!r} exists")
+    api_token, token = ApiToken.issue(name)
+    db_session.add(api_token)
+    db_session.commit()
+    click.echo(f"Api token for {name!r} (shown only once):")
+    click.echo(token)
+
+@click.command('revoke-api-token')
+@click.argument('name')
+def revoke_api_token_command(name):
+    """Revoke a json api token"""
+    api_token = ApiToken.query.filter(ApiToken.name == name).first()
+    if api_token is None:
+        raise click.ClickException(f"No api token named {name!r}")
+    api_token.revoked = True
+    db_session.commit()
+    click.echo(f"Revoked api token {name!r}")
+
 def init_app(app):
     app.cli.add_command(create_admin_command)
+    app.cli.add_command(export_attendance_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(import_students_command)
+    app.cli.add_command(run_scheduler_command)
+    app.cli.add_command(run_attendance_writer_command)
+    app.cli.add_command(create_api_token_command)
+    app.cli.add_command(revoke_api_token_command)
 
@@ -1,37 +1,181 @@
 from sqlalchemy.orm import scoped_session, sessionmaker
 from werkzeug.security import generate_password_hash
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import create_engine, exists
+from sqlalchemy import create_engine, exists, event, make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import IntegrityError
 from flask import current_app
 import click
 
+import base64
+import json
 import os
 
 from . import settings
 
+def make_engine(url, pool_size=5, max_overflow=10, pool_timeout=30, sqlite_pragmas=None):
+    """
+    Creates an engine for url
+
+    sqlite_pragmas are applied to every new connection of a sqlite engine.
+    The pool settings only apply to a QueuePool, in-memory sqlite gets a
+    SingletonThreadPool that takes none of them
+    """
+    url = make_url(url)
+    pool_options = {}
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        pool_options = dict(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    engine = create_engine(
+        url,
+        pool_pre_ping=url.get_backend_name() != "sqlite",
+        **pool_options,
+    )
+
+    if engine.dialect.name == "sqlite" and sqlite_pragmas:
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return engine
+
+
+def engine_from_config(config):
+    """Creates an engine from a mapping of settings (app.config or settings)"""
+    url = config.get("DATABASE_URL") or f"sqlite:///{config['DATABASE']}"
+    return make_engine(
+        url,
+        pool_size=config["DB_POOL_SIZE"],
+        max_overflow=config["DB_MAX_OVERFLOW"],
+        pool_timeout=config["DB_POOL_TIMEOUT"],
+        sqlite_pragmas=config["SQLITE_PRAGMAS"],
+    )
+
+
 db_path = settings.DATABASE
-engine = create_engine(f"sqlite:///{db_path}")
+engine = engine_from_config(vars(settings))
 db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
+
+def configure_engine(config):
+    """Rebinds db_session to an engine built from config"""
+    global engine
+    engine.dispose()
+    engine = engine_from_config(config)
+    db_session.remove()
+    db_session.configure(bind=engine)
+
 class Base(DeclarativeBase):
     query = db_session.query_property()
 
 
+def _dialect_insert(model):
+    # INSERT construct of the bound dialect, these support conflict clauses
+    dialect = db_session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        # mysql and mariadb
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+    return dialect, dialect_insert(model)
+
+
+def insert_or_ignore(model):
+    """
+    Returns an INSERT for model that skips rows clashing with an existing key
+    instead of raising, (INSERT ... ON CONFLICT DO NOTHING)
+    """
+    dialect, stmt = _dialect_insert(model)
+    if dialect in ("sqlite", "postgresql"):
+        return stmt.on_conflict_do_nothing()
+    return stmt.prefix_with("IGNORE")
+
+
+def upsert(model, values, index_elements, set_):
+    """
+    Returns an INSERT of values into model that applies set_ to the
+    existing row instead when it clashes on index_elements
+    (INSERT ... ON CONFLICT DO UPDATE)
+    """
+    dialect, stmt = _dialect_insert(model)
+    stmt = stmt.values(**values)
+    if dialect in ("sqlite", "postgresql"):
+        return stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+    return stmt.on_duplicate_key_update(**set_)
+
+
+def iter_rows(stmt, fetch_size=1000):
+    """Yields the rows of stmt, fetched fetch_size at a time from a streaming cursor"""
+    result = db_session.execute(stmt.execution_options(yield_per=fetch_size))
+    for partition in result.partitions():
+        yield from partition
+
+
+def encode_cursor(*values):
+    """Opaque page cursor holding the sort key values of a page's last row"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the values encoded in cursor, raises ValueError if it is not one of ours"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
 def init_db():
     from . import models
     Base.metadata.create_all(bind=engine)
 
 
+def upgrade_db():
+    """
+    Brings an existing database up to date with the models
+
+    Creates missing tables and indexes, existing data is left untouched
+    """
+    from . import models
+    Base.metadata.create_all(bind=engine)
+    # create_all skips tables that exist, so add their new indexes here
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except IntegrityError:
+                # a unique index cannot be built over duplicate rows
+                click.echo(f"Could not create {index.name}: {table.name} has duplicate values, remove them and try again")
+
+
 @click.command('init-db')
 def init_db_command():
     """Clear existing data and create new tables"""
-    if os.path.exists(db_path):
+    db_path = current_app.config["DATABASE"]
+    if current_app.config.get("DATABASE_URL"):
+        print(f"This will delete all existing data at {engine.url!r}.")
+        option = input("Are you sure you want to proceed? [Y/N]: ")
+        if option.lower() in ['n', 'no']:
+            return
+        elif option.lower() in ['y', 'yes']:
+            click.echo("Initializing database...")
+            Base.metadata.drop_all(bind=engine)
+            init_db()
+            click.echo("Initialized database")
+        else:
+            raise ValueError(f"Unexpected value: {option}. Expected Y or N")
+    elif os.path.exists(db_path):
         print(f"This will delete all existing data at {os.path.basename(db_path)}.")
         option = input("Are you sure you want to proceed? [Y/N]: ")
         if option.lower() in ['n', 'no']:
             return
         elif option.lower() in ['y', 'yes']:
             click.echo("Initializing database...")
+            # close pooled connections before removing the file
+            engine.dispose()
             os.remove(db_path)
             init_db()
             click.echo("Initialized database")
@@ -43,10 +187,21 @@ def init_db_command():
         click.echo("Initialzed database")
 
 
+@click.command('upgrade-db')
+def upgrade_db_command():
+    """Add missing tables and indexes to an existing database"""
+    click.echo("Upgrading database...")
+    upgrade_db()
+    click.echo("Upgraded database")
+
+
 def shutdown_session(exception=None):
     db_session.remove()
 
 def init_app(app):
+    # build the engine from app config (instance config may override settings)
+    configure_engine(app.config)
     # clean up db session after handling request
     app.teardown_appcontext(shutdown_session)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(upgrade_db_command)
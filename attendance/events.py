@@ -0,0 +1,126 @@
+# resolve the event open for attendance today
+
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+
+from .models import Event, StudentStats
+from .db import db_session
+from .feed import archive_feed, publish_closed
+from .writebehind import AttendanceWriter
+
+from datetime import datetime, date
+import json
+import socket
+import time
+
+
+# broker key holding a snapshot of a day's open event
+CURRENT_EVENT_KEY = "current-event:{day}"
+
+# attendance writer name close_event saves the queue as
+CLOSER_CONSUMER = f"{socket.gethostname()}-closer"
+
+# app.extensions entry holding the app's own copy of the current event,
+# (day, expires_at, snapshot), kept per app so apps in one process
+# (tests, several create_app() calls) do not share it
+LOCAL_CACHE = "current_event"
+_EMPTY_CACHE = (None, 0.0, None)
+
+
+def _cache_key(day):
+    return CURRENT_EVENT_KEY.format(day=day.isoformat())
+
+
+def _snapshot(event):
+    """Returns a json friendly representation of event (None if no event)"""
+    if event is None:
+        return None
+    return {
+        'id': event.id,
+        'date': event.date.isoformat(),
+        'created_by': event.created_by,
+        'closed': event.closed,
+    }
+
+
+def _from_snapshot(snapshot):
+    """
+    Rebuilds an Event from snapshot and attaches it to the current session
+    without emitting a SELECT
+    """
+    event = Event(datetime.fromisoformat(snapshot['date']))
+    event.id = snapshot['id']
+    event.created_by = snapshot['created_by']
+    event.closed = snapshot['closed']
+    make_transient_to_detached(event)
+    return db_session.merge(event, load=False)
+
+
+def _query_event(day):
+    # a class scheduled for later in the day opens at its start time
+    return Event.query.filter(
+            Event.on_day(day),
+            Event.date <= datetime.now(),
+            Event.closed == False
+        ).first()
+
+
+def _shared_snapshot(day):
+    """Reads the day's event snapshot from the broker, falling back to the database"""
+    key = _cache_key(day)
+    cached = current_app.broker.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    snapshot = _snapshot(_query_event(day))
+    current_app.broker.set(key, json.dumps(snapshot), ex=current_app.config["CURRENT_EVENT_REDIS_TTL"])
+    return snapshot
+
+
+def get_current_event():
+    """
+    Returns today's open event (or None)
+
+    The lookup is served from a short lived per-app cache, then from a
+    broker key shared by all processes, and only hits the database when both
+    have expired. Negative results are cached too.
+    """
+    today = date.today()
+    day, expires_at, snapshot = current_app.extensions.get(LOCAL_CACHE, _EMPTY_CACHE)
+    now = time.monotonic()
+
+    if day != today or now >= expires_at:
+        snapshot = _shared_snapshot(today)
+        current_app.extensions[LOCAL_CACHE] = (today, now + current_app.config["CURRENT_EVENT_TTL"], snapshot)
+
+    if snapshot is None:
+        return None
+    return _from_snapshot(snapshot)
+
+
+def invalidate_current_event(day=None):
+    """Drops the cached event for day (defaults to today) in this process and on the broker"""
+    day = day or date.today()
+    current_app.extensions.pop(LOCAL_CACHE, None)
+    current_app.broker.delete(_cache_key(day))
+
+
+def close_event(event):
+    """
+    Closes event for attendance, ends the streaks of students who missed
+    it and invalidates the cached current event
+
+    In write-behind mode the attendance queue is saved first, so taps
+    taken before the close count towards the streaks. The event's feed
+    is archived and its live viewers are told to end their streams.
+    """
+    if current_app.config["ATTENDANCE_WRITE_MODE"] == "write-behind":
+        writer = AttendanceWriter(current_app._get_current_object(), consumer=CLOSER_CONSUMER)
+        writer.flush()
+    event.close()
+    db_session.add(event)
+    StudentStats.end_streaks(event.id)
+    db_session.commit()
+    invalidate_current_event(event.date.date())
+    archive_feed(event.id)
+    publish_closed(event.id)
@@ -0,0 +1,83 @@
+# attendance export
+#
+# rows are read through a streaming cursor and written out in chunks, so
+# memory stays flat whether the export is one class or a whole semester
+
+from sqlalchemy import select
+
+from .models import Attendance, Event, Student
+
+from datetime import datetime, time, timedelta
+import csv
+import io
+
+
+EXPORT_COLUMNS = (
+    'event_id', 'event_date', 'reg_num', 'firstname', 'lastname',
+    'department', 'level', 'arrival_time',
+)
+
+# rows per yielded csv chunk
+CHUNK_ROWS = 500
+
+
+def export_query(event_id=None, start=None, end=None, department=None, level=None):
+    """
+    Returns a SELECT of attendance joined with student and event
+
+    start and end are dates (inclusive), every filter is optional
+    """
+    stmt = (
+        select(
+            Event.id, Event.date, Student.reg_num, Student.firstname,
+            Student.lastname, Student.department, Student.level,
+            Attendance.arrival_time,
+        )
+        .join_from(Attendance, Event, Attendance.event_id == Event.id)
+        .join(Student, Attendance.student_id == Student.id)
+        .order_by(Event.date, Attendance.arrival_time)
+    )
+    if event_id is not None:
+        stmt = stmt.where(Attendance.event_id == event_id)
+    if start is not None:
+        stmt = stmt.where(Event.date >= datetime.combine(start, time.min))
+    if end is not None:
+        stmt = stmt.where(Event.date < datetime.combine(end, time.min) + timedelta(days=1))
+    if department:
+        stmt = stmt.where(Student.department == department)
+    if level is not None:
+        stmt = stmt.where(Student.level == level)
+    return stmt
+
+
+def iter_csv(rows):
+    """Yields csv text in chunks of CHUNK_ROWS rows, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def write_xlsx(rows, fileobj):
+    """
+    Writes rows to fileobj as an xlsx workbook
+
+    Needs openpyxl, its write-only mode keeps rows out of memory
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("XLSX export needs openpyxl, install it with 'pip install openpyxl'")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("attendance")
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(list(row))
+    workbook.save(fileobj)
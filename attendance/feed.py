@@ -0,0 +1,254 @@
+# live attendance feed, kept on the broker per event
+#
+# records are appended to a stream per event, the stream entry id
+# doubles as the server-sent event id so reconnecting clients can replay
+# what they missed from Last-Event-ID
+#
+# a record is serialized to json bytes once, when attendance is taken,
+# and those bytes are stored, published and sent to live viewers as is
+
+from flask import current_app
+
+from functools import lru_cache
+import json
+
+
+FEED_KEY = "attendance:{event_id}:stream"
+# a closed event's feed is renamed to this key
+ARCHIVE_KEY = "attendance:{event_id}:archive"
+# live updates are published per event on this channel
+UPDATE_CHANNEL_PREFIX = "attendance-update"
+# record id of the update telling live viewers their event has closed
+CLOSED_ID = "closed"
+
+
+class AttendanceRecord:
+    """A row of the live attendance table"""
+
+    __slots__ = ("reg_num", "firstname", "lastname", "department", "arrival_time", "_data")
+    FIELDS = ("reg_num", "firstname", "lastname", "department", "arrival_time")
+
+    def __init__(self, reg_num, firstname, lastname, department, arrival_time, data=None):
+        self.reg_num = reg_num
+        self.firstname = firstname
+        self.lastname = lastname
+        self.department = department
+        self.arrival_time = arrival_time
+        self._data = data
+
+    @classmethod
+    def for_student(cls, student, arrival_time):
+        """Record of student (a Student or session identity) arriving at arrival_time"""
+        return cls(
+            student.reg_num, student.firstname, student.lastname,
+            student.department, arrival_time.strftime('%H : %M'),
+        )
+
+    def to_bytes(self):
+        """The record as compact json, serialized on the first call only"""
+        if self._data is None:
+            fields = {name: getattr(self, name) for name in self.FIELDS}
+            self._data = json.dumps(fields, separators=(",", ":")).encode()
+        return self._data
+
+    @classmethod
+    def from_bytes(cls, data):
+        fields = json.loads(data)
+        return cls(*(fields.get(name) for name in cls.FIELDS), data=data)
+
+    def __repr__(self):
+        return f"<AttendanceRecord {self.reg_num} {self.arrival_time}>"
+
+
+# feed entries never change, so pages of the same feed loaded again
+# (or by several admins) reuse the records parsed the first time
+load_record = lru_cache(maxsize=4096)(AttendanceRecord.from_bytes)
+
+
+def feed_key(event_id):
+    return FEED_KEY.format(event_id=event_id)
+
+
+def archive_key(event_id):
+    return ARCHIVE_KEY.format(event_id=event_id)
+
+
+def update_channel(event_id):
+    return f"{UPDATE_CHANNEL_PREFIX}:{event_id}"
+
+
+def pack_update(record_id, record):
+    """Frames a published update as b"<record_id> <record json>" (as PUSH_RECORD_SCRIPT does)"""
+    if isinstance(record_id, str):
+        record_id = record_id.encode()
+    if isinstance(record, str):
+        record = record.encode()
+    return record_id + b" " + record
+
+
+def unpack_update(data):
+    """Returns (record_id, record json) from a published update"""
+    record_id, _, record = data.partition(b" ")
+    return record_id.decode(), record
+
+
+def id_key(record_id):
+    """Sort key of a stream entry id ("<ms>-<seq>")"""
+    ms, _, seq = record_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+# appends records (ARGV[3:]) to the feed and publishes them to live
+# viewers, one round trip instead of separate XADD, EXPIRE and PUBLISH
+# calls per record, returns the record ids
+PUSH_RECORD_SCRIPT = """
+local record_ids = {}
+for i = 3, #ARGV do
+    local record_id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'record', ARGV[i])
+    redis.call('PUBLISH', KEYS[2], record_id .. ' ' .. ARGV[i])
+    record_ids[#record_ids + 1] = record_id
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return record_ids
+"""
+
+
+def push_record_fallback(broker, keys, args):
+    # PUSH_RECORD_SCRIPT for brokers without lua
+    feed, channel = keys
+    maxlen, ttl, *records = args
+    record_ids = []
+    for record in records:
+        record_id = broker.xadd(feed, {"record": record}, maxlen=int(maxlen))
+        broker.publish(channel, pack_update(record_id, record))
+        record_ids.append(record_id)
+    broker.expire(feed, int(ttl))
+    return record_ids
+
+
+# moves a feed to its archive key, a feed that was never written (or
+# already archived) is left alone
+ARCHIVE_FEED_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+def _archive_feed(broker, keys, args):
+    # ARCHIVE_FEED_SCRIPT for brokers without lua
+    feed, archive = keys
+    if not broker.exists(feed):
+        return 0
+    broker.rename(feed, archive)
+    broker.expire(archive, int(args[0]))
+    return 1
+
+
+def load_script(name, source, fallback):
+    """
+    Returns the app's broker script for source (or its python fallback),
+    registered once under name
+    """
+    script = current_app.extensions.get(name)
+    if script is None:
+        script = current_app.broker.script(source, fallback)
+        current_app.extensions[name] = script
+    return script
+
+
+def push_records(event_id, records):
+    """
+    Appends records (AttendanceRecord.to_bytes()) to the event's feed and
+    publishes them to the event's live viewers in one broker call,
+    returns the record ids
+
+    The feed is capped at about FEED_MAX_LENGTH records and expires
+    FEED_TTL seconds after the last write
+    """
+    if not records:
+        return []
+    script = load_script("push_record_script", PUSH_RECORD_SCRIPT, push_record_fallback)
+    config = current_app.config
+    record_ids = script(
+        keys=[feed_key(event_id), update_channel(event_id)],
+        args=[config["FEED_MAX_LENGTH"], config["FEED_TTL"], *records],
+    )
+    return [record_id.decode() for record_id in record_ids]
+
+
+def push_record(event_id, record):
+    """Appends one record to the event's feed as push_records does, returns its id"""
+    return push_records(event_id, [record])[0]
+
+
+def read_records(event_id, before=None, count=None):
+    """
+    Returns a page of the event's feed, most recent first
+
+    Returns (records, cursor), records are AttendanceRecords, pass cursor as before
+    to get the next (older) page, cursor is None on the last page
+    """
+    count = count or current_app.config["FEED_PAGE_SIZE"]
+    newest = "+" if before is None else before
+    # ask for one more entry as the range includes before itself
+    entries = current_app.broker.xrevrange(feed_key(event_id), newest, "-", count=count + 1)
+    entries = [(i.decode(), fields) for i, fields in entries]
+    if before is not None:
+        entries = [(i, fields) for i, fields in entries if i != before]
+    entries = entries[:count]
+
+    records = [load_record(fields[b"record"]) for _, fields in entries]
+    cursor = entries[-1][0] if len(entries) == count else None
+    return records, cursor
+
+
+def latest_id(event_id):
+    """Id of the most recent record in the event's feed (None if empty)"""
+    entries = current_app.broker.xrevrange(feed_key(event_id), "+", "-", count=1)
+    return entries[0][0].decode() if entries else None
+
+
+def read_since(event_id, last_id):
+    """Returns [(record_id, record json)] added to the event's feed after last_id"""
+    try:
+        id_key(last_id)
+    except ValueError:
+        # not an id we handed out
+        return []
+    entries = current_app.broker.xrange(feed_key(event_id), last_id, "+")
+    return [
+        (i.decode(), fields[b"record"])
+        for i, fields in entries
+        if i.decode() != last_id
+    ]
+
+
+def archive_feed(event_id):
+    """
+    Moves a closed event's feed out of the live key, it is kept for
+    FEED_ARCHIVE_TTL seconds. Returns False if there was no feed
+    """
+    script = load_script("archive_feed_script", ARCHIVE_FEED_SCRIPT, _archive_feed)
+    archived = script(
+        keys=[feed_key(event_id), archive_key(event_id)],
+        args=[current_app.config["FEED_ARCHIVE_TTL"]],
+    )
+    return bool(archived)
+
+
+def publish_closed(event_id):
+    """Tells the event's live viewers that it has closed, after any records already published"""
+    current_app.broker.publish(update_channel(event_id), pack_update(CLOSED_ID, b"{}"))
+
+
+def split_closed(updates):
+    """
+    Returns (records, closed) from a list of unpacked updates, closed is
+    True if the event closed after these records
+    """
+    records = [update for update in updates if update[0] != CLOSED_ID]
+    return records, len(records) != len(updates)
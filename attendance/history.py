@@ -0,0 +1,101 @@
+# past events and their attendance, a page at a time
+#
+# pages are keyset paginated: a page's cursor holds the sort key of its
+# last row and the next page starts after it, so every page is an index
+# range scan however far back it is. Events are listed on (date, id),
+# most recent first, an event's attendance on (arrival_time, student_id).
+#
+# the "after the cursor" predicate repeats the leading column as a plain
+# range (date <= d AND (date < d OR ...)), the OR alone is not used to
+# seek the index and would scan from the first row.
+
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.orm import contains_eager, joinedload
+
+from .models import Attendance, Event
+from .db import db_session, encode_cursor, decode_cursor
+
+from datetime import datetime
+
+
+def _page(rows, limit, key):
+    # a page is read with limit + 1 rows, the extra one tells there is a next page
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def _decode(cursor):
+    # (datetime, id) from a cursor
+    try:
+        when, key = decode_cursor(cursor)
+        return datetime.fromisoformat(when), int(key)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+def event_page(cursor=None, limit=50):
+    """
+    Returns (events, next cursor), most recent first, next cursor is None
+    on the last page. Raises ValueError for a cursor that is not one of ours.
+
+    Each event's admin is loaded with it and its attendance count is set
+    as event.attendance_count, in one grouped query for the page.
+    """
+    stmt = (
+        select(Event)
+        .options(joinedload(Event.admin))
+        .order_by(Event.date.desc(), Event.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        date, event_id = _decode(cursor)
+        stmt = stmt.where(Event.date <= date, or_(
+            Event.date < date,
+            and_(Event.date == date, Event.id < event_id),
+        ))
+    events, next_cursor = _page(
+        db_session.execute(stmt).scalars().all(), limit,
+        lambda event: (event.date.isoformat(), event.id),
+    )
+
+    counts = {}
+    if events:
+        count_stmt = (
+            select(Attendance.event_id, func.count())
+            .where(Attendance.event_id.in_([event.id for event in events]))
+            .group_by(Attendance.event_id)
+        )
+        counts = dict(db_session.execute(count_stmt).all())
+    for event in events:
+        event.attendance_count = counts.get(event.id, 0)
+    return events, next_cursor
+
+
+def attendance_page(event_id, cursor=None, limit=50):
+    """
+    Returns (attendance, next cursor) of an event in arrival order, next
+    cursor is None on the last page. Raises ValueError for a cursor that
+    is not one of ours.
+
+    Each Attendance has its student loaded by the same query.
+    """
+    stmt = (
+        select(Attendance)
+        .join(Attendance.student)
+        .options(contains_eager(Attendance.student))
+        .where(Attendance.event_id == event_id)
+        .order_by(Attendance.arrival_time, Attendance.student_id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        arrival_time, student_id = _decode(cursor)
+        stmt = stmt.where(Attendance.arrival_time >= arrival_time, or_(
+            Attendance.arrival_time > arrival_time,
+            and_(Attendance.arrival_time == arrival_time, Attendance.student_id > student_id),
+        ))
+    return _page(
+        db_session.execute(stmt).scalars().all(), limit,
+        lambda attendance: (attendance.arrival_time.isoformat(), attendance.student_id),
+    )
@@ -0,0 +1,81 @@
+# identity of the logged in student or admin, carried in the signed session
+#
+# pages mostly need a name and a registration number, keeping those in the
+# session cookie means loading g.student / g.admin costs no query, the full
+# row is only loaded when a view asks for something the session lacks
+
+from flask import flash, redirect, session, url_for
+
+from .db import db_session
+
+
+class IdentityGone(Exception):
+    """The session's student or admin was deleted from the database"""
+
+    def __init__(self, model):
+        super().__init__(f"{model.__name__} no longer exists")
+        self.model = model
+
+
+STUDENT_FIELDS = ('id', 'reg_num', 'firstname', 'lastname', 'department', 'level', 'phone_number')
+ADMIN_FIELDS = ('id', 'username', 'firstname', 'lastname')
+
+
+class Identity:
+    """
+    Session backed stand-in for a Student or Admin
+
+    Attributes kept in the session are read from it, anything else loads
+    the model from the database (once per request). Raises IdentityGone
+    if the row has been deleted since the session was issued.
+    """
+
+    def __init__(self, model, data):
+        self._model = model
+        self._data = data
+        self._obj = None
+
+    def __getattr__(self, name):
+        # only called for attributes not set in __init__
+        data = self.__dict__['_data']
+        if name in data:
+            return data[name]
+        return getattr(self.obj, name)
+
+    @property
+    def obj(self):
+        """The full model instance"""
+        if self._obj is None:
+            self._obj = db_session.get(self._model, self._data['id'])
+            if self._obj is None:
+                raise IdentityGone(self._model)
+        return self._obj
+
+    def __repr__(self):
+        return f"<Identity {self._model.__name__} {self._data['id']!r}>"
+
+
+def to_identity(obj, fields):
+    """Returns the session payload for a Student or Admin"""
+    return {field: getattr(obj, field) for field in fields}
+
+
+def student_identity(student):
+    return to_identity(student, STUDENT_FIELDS)
+
+
+def admin_identity(admin):
+    return to_identity(admin, ADMIN_FIELDS)
+
+
+def logged_out(error):
+    """IdentityGone handler, a session for a deleted row is logged out"""
+    session.clear()
+    flash("Your account no longer exists", "error")
+    if error.model.__name__ == "Admin":
+        return redirect(url_for('admin.admin_login'))
+    return redirect(url_for('auth.login'))
+
+
+def init_app(app):
+    app.register_error_handler(IdentityGone, logged_out)
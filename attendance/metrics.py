@@ -0,0 +1,254 @@
+# request, database and broker metrics, served on /metrics
+#
+# with METRICS_ENABLED the engine and broker are timed and every request
+# records its latency and the statements it ran. Queries are labelled with
+# the request hook that ran them (setup_event, load_student, load_admin)
+# or the endpoint, statements slower than SLOW_QUERY_THRESHOLD seconds are
+# logged. Metrics are kept per process in prometheus text format.
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from flask import (
+    Blueprint, Response, current_app, flash, g,
+    has_app_context, has_request_context, redirect, request, url_for,
+)
+
+from bisect import bisect_left
+import functools
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint("metrics", __name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BROKER_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1)
+STREAM_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 3 * 3600)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.series = {}  # label values: count
+
+    def add(self, labels=(), amount=1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.series.items():
+            yield self.name, self._labels(labels), value
+
+    def _labels(self, values, **extra):
+        pairs = [*zip(self.labelnames, values), *extra.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, labels=()):
+        self.series[labels] = value
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def add(self, labels=(), value=0):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", self._labels(labels, le=bound), cumulative
+            yield f"{self.name}_sum", self._labels(labels), round(total, 6)
+            yield f"{self.name}_count", self._labels(labels), cumulative
+
+
+class Metrics:
+    """The metrics of one app, updated under a lock"""
+
+    def __init__(self, slow_query_threshold):
+        self.slow_query_threshold = slow_query_threshold
+        self._lock = threading.Lock()
+        self.request_seconds = Histogram(
+            "attendance_request_seconds", "Request latency", ("endpoint",), REQUEST_BUCKETS)
+        self.responses = Counter(
+            "attendance_responses_total", "Responses sent", ("endpoint", "status"))
+        self.request_queries = Histogram(
+            "attendance_request_queries", "SQL statements per request", ("endpoint",), QUERY_COUNT_BUCKETS)
+        self.query_seconds = Histogram(
+            "attendance_db_query_seconds", "SQL statement duration", ("source",), QUERY_BUCKETS)
+        self.slow_queries = Counter(
+            "attendance_db_slow_queries_total", "SQL statements slower than SLOW_QUERY_THRESHOLD", ("source",))
+        self.broker_seconds = Histogram(
+            "attendance_broker_seconds", "Broker call duration", ("op",), BROKER_BUCKETS)
+        self.stream_seconds = Histogram(
+            "attendance_live_stream_seconds", "Time live attendance streams stayed open", (), STREAM_BUCKETS)
+        self.live_connections = Gauge(
+            "attendance_live_connections", "Live attendance streams open in this process")
+
+    def observe(self, metric, labels, value):
+        with self._lock:
+            metric.add(labels, value)
+
+    def render(self, live_connections):
+        lines = []
+        with self._lock:
+            self.live_connections.set(live_connections)
+            for metric in vars(self).values():
+                if not isinstance(metric, Counter):
+                    continue
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+def _current():
+    if has_app_context():
+        return current_app.extensions.get("metrics")
+    return None
+
+
+def observe_stream(seconds):
+    """Records how long a live attendance stream was open"""
+    metrics = _current()
+    if metrics is not None:
+        metrics.observe(metrics.stream_seconds, (), seconds)
+
+
+# engine hooks, listening on Engine covers engines rebuilt by configure_engine
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    metrics = _current()
+    if start is None or metrics is None:
+        return
+    elapsed = time.perf_counter() - start
+
+    source = "background"
+    if has_request_context():
+        source = g.get("_metrics_source") or request.endpoint or "unknown"
+        g._metrics_queries = g.get("_metrics_queries", 0) + 1
+
+    metrics.observe(metrics.query_seconds, (source,), elapsed)
+    if elapsed >= metrics.slow_query_threshold:
+        metrics.observe(metrics.slow_queries, (source,), 1)
+        logger.warning("Slow query (%.3fs) in %s: %s", elapsed, source, statement)
+
+
+class InstrumentedBroker:
+    """Times the calls made to a broker, scripts are timed as "script" """
+
+    def __init__(self, broker, metrics):
+        self.broker = broker
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self.broker, name)
+        if not callable(attr):
+            return attr
+        timed = self._timed(attr, name)
+        if name == "script":
+            def script(source, fallback):
+                return self._timed(attr(source, fallback), "script")
+            timed = script
+        # cache the wrapper, later lookups skip __getattr__
+        setattr(self, name, timed)
+        return timed
+
+    def _timed(self, func, op):
+        metrics = self.metrics
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe(metrics.broker_seconds, (op,), time.perf_counter() - start)
+        return call
+
+
+def _start_request():
+    g._metrics_start = time.perf_counter()
+    g._metrics_queries = 0
+
+
+def _end_request(response):
+    metrics = current_app.extensions["metrics"]
+    start = g.get("_metrics_start")
+    if start is not None:
+        endpoint = request.endpoint or "unknown"
+        metrics.observe(metrics.request_seconds, (endpoint,), time.perf_counter() - start)
+        metrics.observe(metrics.request_queries, (endpoint,), g.get("_metrics_queries", 0))
+        metrics.observe(metrics.responses, (endpoint, str(response.status_code)), 1)
+    return response
+
+
+def _labelled_hook(hook):
+    # queries run by the hook are labelled with its name, not the endpoint
+    @functools.wraps(hook)
+    def wrapped():
+        g._metrics_source = hook.__name__
+        try:
+            return hook()
+        finally:
+            g._metrics_source = None
+    return wrapped
+
+
+@bp.route("/metrics")
+def metrics():
+    token = current_app.config["METRICS_TOKEN"]
+    authorized = token and request.headers.get("Authorization") == f"Bearer {token}"
+    if g.admin is None and not authorized:
+        flash("Not Allowed", "error")
+        return redirect(url_for('admin.admin_login'))
+
+    body = current_app.extensions["metrics"].render(current_app.broadcaster.connection_count)
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """
+    Starts collecting metrics for app, call after the blueprints and
+    request hooks are registered
+    """
+    metrics = app.extensions["metrics"] = Metrics(app.config["SLOW_QUERY_THRESHOLD"])
+    app.broker = InstrumentedBroker(app.broker, metrics)
+    app.broadcaster.broker = app.broker
+
+    hooks = app.before_request_funcs.setdefault(None, [])
+    hooks[:] = [_start_request, *(_labelled_hook(hook) for hook in hooks)]
+    app.after_request(_end_request)
+    app.register_blueprint(bp)
@@ -3,7 +3,9 @@ from __future__ import annotations
 from sqlalchemy import (
         String, DateTime, Integer,
         Column, ForeignKey, Table,
-        Boolean, Text
+        Boolean, Text, Index,
+        and_, case, update, or_,
+        bindparam,
 )
 
 from sqlalchemy.orm import DeclarativeBase
@@ -11,17 +13,23 @@ from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import validates
 from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import WriteOnlyMapped
 
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta, time
+import hashlib
 import json
-import re
+import secrets
 
-from .db import Base
+from .db import Base, db_session, insert_or_ignore, upsert
+from .validation import STUDENT_SCHEMA
 
 
 class Attendance(Base):
     __tablename__ = "attendance"
+    __table_args__ = (
+        # serves an event's attendance in arrival order, page by page
+        Index("ix_attendance_event_arrival", "event_id", "arrival_time", "student_id"),
+    )
 
     event_id: Mapped[int] = mapped_column(ForeignKey("event.id"), primary_key=True)
     student_id: Mapped[int] = mapped_column(ForeignKey("student.id"), primary_key=True)
@@ -33,19 +41,41 @@ class Attendance(Base):
         self.event = event
         self.student = student
 
+    @classmethod
+    def record_many(cls, event_id, arrivals):
+        """
+        Records [(student_id, arrival_time)] at event with one executemany,
+        students whose attendance was already taken are skipped
+
+        Returns the set of student ids recorded. The caller is responsible for committing.
+        """
+        if not arrivals:
+            return set()
+        rows = [
+            dict(event_id=event_id, student_id=student_id, arrival_time=arrival_time)
+            for student_id, arrival_time in arrivals
+        ]
+        stmt = insert_or_ignore(cls)
+        connection = db_session.connection()
+        if connection.dialect.insert_executemany_returning:
+            result = connection.execute(stmt.returning(cls.student_id), rows)
+            return set(result.scalars())
+        # no RETURNING (mysql), the rowcount of each row tells
+        return {row["student_id"] for row in rows if connection.execute(stmt, row).rowcount == 1}
+
 class Student(Base):
 
     __tablename__ = "student"
-    VALID_LEVELS = '100 200 300 400 500'.split(' ')
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    reg_num: Mapped[str]  = mapped_column(String(11), nullable=False)
+    reg_num: Mapped[str]  = mapped_column(String(11), nullable=False, unique=True, index=True)
     firstname: Mapped[str]  = mapped_column(String(30), nullable=False)
     lastname: Mapped[str] = mapped_column(String(30), nullable=False)
     phone_number: Mapped[str] = mapped_column(String(11), nullable=True)
     department: Mapped[str] = mapped_column(String(15), nullable=False)
     level: Mapped[int] = mapped_column(Integer, nullable=False)
-    events: Mapped[List[Attendance]] = relationship(back_populates="student")
+    # write-only, an attendance history is read a page at a time (see history.py)
+    events: WriteOnlyMapped[Attendance] = relationship(back_populates="student")
 
     def __init__(self, reg_num, firstname, lastname, department, level, phone_number=None):
         self.reg_num = reg_num
@@ -55,29 +85,11 @@ class Student(Base):
         self.level = level
         self.department = department
 
-    @validates("level")
-    def validate_level(self, key, level):
-        if level not in self.VALID_LEVELS:
-            raise ValueError(f"{level} is not a valid option, select any of [", *VALID_LEVELS, "]")
-        return level
-    
-    @validates('phone_number')
-    def validate_phone_number(self, key, phone_number):
-        if phone_number is None:
-            return None
-
-        pattern = r"^0[789]\d{9}$"
-        if re.match(pattern, phone_number) is None:
-            raise ValueError(f"{phone_number} does not seem to be a valid phone number")
-        return phone_number
-
-    @validates('reg_num')
-    def validate_reg_no(self, key, reg_no):
-        pattern = r"^20[1-2][0-9]/\d{6}$"
-        if re.match(pattern, reg_no) is not None:
-            return reg_no
-        raise ValueError(f"{reg_no} is not a valid registration number")
-    
+    @validates(*STUDENT_SCHEMA.fields)
+    def validate_field(self, key, value):
+        # same rules as the forms, raises ValueError if invalid
+        return STUDENT_SCHEMA.check(key, value)
+
     def to_json(self, mask=['id'], **extra_kw):
         """
         Returns a dict representation of Student
@@ -90,7 +102,7 @@ class Student(Base):
         student = {}
         for attr in attrs:
             if attr not in mask:
-                student[attr] = self.__dict__.get(attr)
+                student[attr] = getattr(self, attr)
 
         student.update(extra_kw)
         return json.dumps(student)
@@ -102,10 +114,17 @@ class Student(Base):
 class Event(Base):
 
     __tablename__ = "event"
+    __table_args__ = (
+        # serves date range lookups and "open event on a day" lookups
+        Index("ix_event_date_closed", "date", "closed"),
+        # serves the event list, most recent first, page by page
+        Index("ix_event_date_id", "date", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     date: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now)
-    attendance: Mapped[List[Attendance]] = relationship(back_populates="event") 
+    # write-only, an event's attendance is read a page at a time (see history.py)
+    attendance: WriteOnlyMapped[Attendance] = relationship(back_populates="event")
     created_by: Mapped[int] = mapped_column(ForeignKey("admin.id"))
     admin: Mapped[Admin] = relationship(back_populates="events")
     closed : Mapped[bool] = mapped_column(Boolean, default=False)
@@ -116,6 +135,17 @@ class Event(Base):
     def __repr__(self):
         return f"<Hands On Python Training Class -- {self.date.strftime('%a %b %d, %Y')}> "
     
+    @classmethod
+    def on_day(cls, day):
+        """
+        Returns a filter for events held on day
+
+        Uses a half-open [day, next day) range on Event.date so the
+        lookup can be served by the date index
+        """
+        start = datetime.combine(day, time.min)
+        return and_(cls.date >= start, cls.date < start + timedelta(days=1))
+
     @property
     def is_closed(self):
         return self.closed
@@ -132,7 +162,7 @@ class Admin(Base):
     firstname: Mapped[str] = mapped_column(String(11), nullable=False)
     lastname: Mapped[str] = mapped_column(String(11), nullable=False)
     password: Mapped[str] = mapped_column(Text, nullable=False)
-    events: Mapped[List[Event]] = relationship(back_populates="admin")
+    events: WriteOnlyMapped[Event] = relationship(back_populates="admin")
 
     def __init__(self, firstname, lastname, username, password):
         self.firstname = firstname
@@ -142,3 +172,117 @@ class Admin(Base):
 
     def __repr__(self):
         return f"<Admin {self.username!r}>"
+
+
+class ApiToken(Base):
+    """
+    Token a kiosk or scanner uses to call the json api
+
+    Only the token's sha256 digest is stored, the token itself is shown
+    once when it is issued (`flask create-api-token`)
+    """
+
+    __tablename__ = "api_token"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    name: Mapped[str] = mapped_column(String(50), nullable=False, unique=True)
+    token_hash: Mapped[str] = mapped_column(String(64), nullable=False, unique=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.now)
+    revoked: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+
+    def __init__(self, name, token_hash):
+        self.name = name
+        self.token_hash = token_hash
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, name):
+        """Returns (api_token, token) for a new token named name, the caller adds and commits it"""
+        token = secrets.token_urlsafe(32)
+        return cls(name, cls.digest(token)), token
+
+    def __repr__(self):
+        return f"<ApiToken {self.name!r}>"
+
+
+class StudentStats(Base):
+    """
+    Attendance summary of a student
+
+    Updated as attendance is taken and events close, so reading a
+    student's figures is a primary key lookup instead of an aggregate
+    over the attendance table (rebuild it with `flask rebuild-stats`)
+    """
+
+    __tablename__ = "student_stats"
+    __table_args__ = (
+        # serves the attendance rankings
+        Index("ix_student_stats_attended", "attended"),
+    )
+
+    student_id: Mapped[int] = mapped_column(ForeignKey("student.id"), primary_key=True)
+    attended: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # classes attended in a row, reset when a class closes without the student
+    current_streak: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    longest_streak: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_seen: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    last_event_id: Mapped[int] = mapped_column(ForeignKey("event.id"), nullable=True)
+
+    @classmethod
+    def record_attendances(cls, event_id, arrivals):
+        """
+        Counts newly recorded attendance, [(student_id, arrival_time)], at
+        event with one executemany upsert
+
+        The caller is responsible for committing.
+        """
+        if not arrivals:
+            return
+        streak = cls.current_streak + 1
+        stmt = upsert(
+            cls,
+            values={},
+            index_elements=[cls.student_id],
+            set_=dict(
+                attended=cls.attended + 1,
+                current_streak=streak,
+                longest_streak=case((streak > cls.longest_streak, streak), else_=cls.longest_streak),
+                last_seen=bindparam("arrival_time"),
+                last_event_id=event_id,
+            ),
+        )
+        rows = [
+            dict(
+                student_id=student_id, attended=1, current_streak=1, longest_streak=1,
+                last_seen=arrival_time, last_event_id=event_id, arrival_time=arrival_time,
+            )
+            for student_id, arrival_time in arrivals
+        ]
+        db_session.connection().execute(stmt, rows)
+
+    @classmethod
+    def end_streaks(cls, event_id):
+        """
+        Resets the current streak of students who missed event
+
+        Called when an event closes. The caller is responsible for committing.
+        """
+        stmt = (
+            update(cls)
+            .where(or_(cls.last_event_id.is_(None), cls.last_event_id != event_id))
+            .where(cls.current_streak != 0)
+            .values(current_streak=0)
+        )
+        db_session.execute(stmt)
+
+    def rate(self, events_held):
+        """Percentage of events_held the student attended"""
+        if not events_held:
+            return 0.0
+        return round(self.attended * 100 / events_held, 1)
+
+    def __repr__(self):
+        return f"<StudentStats {self.student_id!r} attended={self.attended!r}>"
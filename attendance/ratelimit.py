@@ -0,0 +1,113 @@
+# token bucket rate limiting of the student pages
+#
+# requests to the register and auth blueprints take a token from a bucket
+# per logged in student and a bucket per client ip, both kept on the
+# broker. A bucket holds up to `burst` tokens and refills at `rate` tokens
+# a second, a request finding either bucket empty gets a 429 before any
+# other request hook runs, so a retry storm costs one broker call per
+# request and no database work
+
+from flask import Response, current_app, request, session
+
+from .feed import load_script
+
+import math
+import time
+
+
+RATE_LIMITED_BLUEPRINTS = {"register", "auth"}
+STUDENT_BUCKET_KEY = "ratelimit:student:{student_id}"
+IP_BUCKET_KEY = "ratelimit:ip:{ip}"
+
+# KEYS are buckets, ARGV[1] is the time in ms followed by the rate
+# (tokens/s) and burst of each bucket. A bucket is stored as
+# "<tokens>:<ms>", a token is taken from every bucket only if all have one.
+# Returns 0, or the ms until the emptiest bucket has a token
+TAKE_TOKEN_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    local available = burst
+    local state = redis.call('GET', key)
+    if state then
+        local sep = string.find(state, ':', 1, true)
+        local stamp = tonumber(string.sub(state, sep + 1))
+        available = math.min(burst, tonumber(string.sub(state, 1, sep - 1)) + (now - stamp) * rate / 1000)
+    end
+    if available < 1 then
+        wait = math.max(wait, math.ceil((1 - available) * 1000 / rate))
+    end
+    tokens[i] = available
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    if wait == 0 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('SET', key, tokens[i] .. ':' .. now, 'PX', math.ceil(burst * 1000 / rate) + 1000)
+end
+return wait
+"""
+
+
+def _take_token(broker, keys, args):
+    # TAKE_TOKEN_SCRIPT for brokers without lua
+    now = int(args[0])
+    limits = [(float(args[i]), float(args[i + 1])) for i in range(1, len(args), 2)]
+    wait = 0
+    tokens = []
+    for key, (rate, burst) in zip(keys, limits):
+        available = burst
+        state = broker.get(key)
+        if state is not None:
+            value, _, stamp = state.decode().partition(":")
+            available = min(burst, float(value) + (now - int(stamp)) * rate / 1000)
+        if available < 1:
+            wait = max(wait, math.ceil((1 - available) * 1000 / rate))
+        tokens.append(available)
+    for key, (rate, burst), available in zip(keys, limits, tokens):
+        if wait == 0:
+            available -= 1
+        broker.set(key, f"{available}:{now}", px=math.ceil(burst * 1000 / rate) + 1000)
+    return wait
+
+
+def take_token(buckets):
+    """
+    Takes a token from each of buckets, [(key, (rate, burst))], returns 0
+    or the seconds to wait when one of them is empty
+    """
+    script = load_script("take_token_script", TAKE_TOKEN_SCRIPT, _take_token)
+    args = [int(time.time() * 1000)]
+    for _, (rate, burst) in buckets:
+        args += [rate, burst]
+    wait = script(keys=[key for key, _ in buckets], args=args)
+    return int(wait) / 1000
+
+
+def limit_rate():
+    """Request hook, answers 429 when the student or their ip is over the limit"""
+    if request.blueprint not in RATE_LIMITED_BLUEPRINTS:
+        return None
+
+    config = current_app.config
+    buckets = [(IP_BUCKET_KEY.format(ip=request.remote_addr), config["RATE_LIMIT_IP"])]
+    student = session.get("student")
+    if student is not None:
+        key = STUDENT_BUCKET_KEY.format(student_id=student["id"])
+        buckets.append((key, config["RATE_LIMIT_STUDENT"]))
+
+    wait = take_token(buckets)
+    if wait:
+        return Response(
+            "Too many requests, try again shortly", 429,
+            {"Retry-After": str(math.ceil(wait))},
+        )
+    return None
+
+
+def init_app(app):
+    """Runs limit_rate before the other request hooks"""
+    app.before_request_funcs.setdefault(None, []).insert(0, limit_rate)
@@ -8,13 +8,16 @@ from flask import (
 )
 
 
-from sqlalchemy import extract, update
+from sqlalchemy.exc import IntegrityError
 from werkzeug.urls import url_parse
 
-from .utils import get_form_errors 
-from .models import Student, Attendance, Event
+from .validation import STUDENT_SCHEMA
+from .models import Student, Attendance, Event, StudentStats
 from .auth import login_required
 from .db import db_session
+from .identity import Identity, student_identity
+from .feed import AttendanceRecord, push_records
+from .writebehind import queue_attendance, is_marked, add_marked
 
 from collections import deque
 from datetime import datetime
@@ -43,34 +46,76 @@ def event_required(view):
 @bp.route('/enroll/<string:reg_num>', methods=["POST", "GET"])
 def enroll(reg_num=None):    
     if request.method == "POST":
-        form = request.form
-        # check for errors
-        errors = get_form_errors(form)
+        # cleaned values of the schema's fields, other form fields are ignored
+        values, errors = STUDENT_SCHEMA.validate(request.form)
         if errors:
             for error in errors:
                 flash(error, 'error')
 
-        # if no errors check if student exists
-        elif Student.query.filter(Student.reg_num == form['reg_num']).first():
-            flash("A student is already enrolled with that registration number", "error")
-      
         else:
             try:
-                new_student = Student(**form)
+                new_student = Student(**values)
             except Exception as e:
                 flash('Something went wrong', 'error')
             else:
+                # single INSERT, the unique index on reg_num rejects duplicates
                 db_session.add(new_student)
-                db_session.commit()
-                flash("Enrolled", "success")
-                session.clear()
-                session['student_id'] = new_student.id
-                g.student = new_student
-                return redirect(url_for('auth.profile'))
+                try:
+                    db_session.commit()
+                except IntegrityError:
+                    db_session.rollback()
+                    flash("A student is already enrolled with that registration number", "error")
+                else:
+                    flash("Enrolled", "success")
+                    session.clear()
+                    session['student'] = student_identity(new_student)
+                    g.student = Identity(Student, session['student'])
+                    return redirect(url_for('auth.profile'))
 
     reg_num = reg_num.replace('_', '/') if reg_num else None
     return render_template("register/enrollment_form.html", reg_num=reg_num)
-    
+
+
+def take_attendance(event_id, taps):
+    """
+    Records taps, [(student, arrival_time)], at event and publishes their
+    records to live viewers, student is a Student or session identity
+
+    Returns the students whose attendance was taken, the others had it
+    taken already. Synchronous taps are committed in one transaction.
+    """
+    if current_app.config["ATTENDANCE_WRITE_MODE"] == "write-behind":
+        # recorded and published on redis, the attendance writer
+        # saves them to the database
+        queued = queue_attendance(event_id, [
+            (student.id, arrival_time, AttendanceRecord.for_student(student, arrival_time).to_bytes())
+            for student, arrival_time in taps
+        ])
+        return [student for student, _ in taps if student.id in queued]
+
+    # one executemany per table, a clashing (event_id, student_id) row is skipped
+    arrivals = [(student.id, arrival_time) for student, arrival_time in taps]
+    recorded = Attendance.record_many(event_id, arrivals)
+    # counted in the same transaction as the attendance rows
+    StudentStats.record_attendances(event_id, [a for a in arrivals if a[0] in recorded])
+
+    taken = []
+    records = []
+    for student, arrival_time in taps:
+        if student.id in recorded:
+            taken.append(student)
+            # live attendance row, serialized once and published as is, built
+            # before the commit expires the attributes it reads (an identity
+            # carries them, the student is not loaded)
+            records.append(AttendanceRecord.for_student(student, arrival_time).to_bytes())
+    db_session.commit()
+    # taken now or by an earlier tap, repeat taps skip the database
+    add_marked(event_id, *(student_id for student_id, _ in arrivals))
+
+    # one broker call for the whole batch
+    push_records(event_id, records)
+    return taken
+
 
 @bp.route('/mark-attendance', methods=["GET"])
 @login_required
@@ -79,50 +124,22 @@ def mark_attendance():
     # check if event is closed
     if g.event.is_closed:
         flash("Class has been closed for attendance", "error")
-        
-        # clean up seen list on redis
-        current_app.redis.unlink('seen')
-
         return redirect(request.referrer)
 
-    # check if student is already in event's attendance
-    attendance_obj = Attendance.query.filter(
-            Attendance.student==g.student, 
-            Attendance.event==g.event
-    ).first() 
-
-    if attendance_obj is not None:
+    # repeat taps are answered from the marked set, without touching the database
+    if is_marked(g.event.id, g.student.id):
         flash("Attendance already taken", "info")
-        
-    if attendance_obj is None:
-        # add student to event attendance via secondary attendance table
-        attendance_obj = Attendance(event=g.event, student=g.student)
-        attendance_obj.student = g.student
-        arrival_time = datetime.now()
-        attendance_obj.arrival_time = arrival_time
-        g.event.attendance.append(attendance_obj)
-        
-        # save in database
-        db_session.add(attendance_obj)
-        db_session.commit()
-
-        
-        ## TODO: add a flag to student showing student is registered
-        session['is_registered'] = True
-
-        # get attendance json representation as record
-        # publish record to attendance update channel
-        # for live update of connected clients
-       
-        arrival_time = attendance_obj.arrival_time # delete after
-        record = attendance_obj.student.to_json(mask=['id', 'level', 'phone_number'], arrival_time=arrival_time.strftime('%H : %M'))
-        
-        current_app.redis.publish("attendance-update", message=record)
-        current_app.redis.lpush("seen", record)
-        
+        return redirect(url_for('auth.profile'))
+
+    created = bool(take_attendance(g.event.id, [(g.student, datetime.now())]))
 
-        flash("Attendance taken", "success")
+    ## TODO: add a flag to student showing student is registered
+    session['is_registered'] = True
 
+    if not created:
+        flash("Attendance already taken", "info")
         return redirect(url_for('auth.profile'))
 
-        
+    flash("Attendance taken", "success")
+
+    return redirect(url_for('auth.profile'))
@@ -0,0 +1,157 @@
+# bulk student enrollment from a roster csv
+#
+# the file is read a batch of rows at a time, each batch is validated with
+# the student schema, checked against enrolled reg_nums in one query and
+# inserted with a single executemany in its own transaction
+
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+
+from .models import Student
+from .db import db_session
+from .validation import STUDENT_SCHEMA
+
+from itertools import islice
+import csv
+import time
+
+
+ROSTER_COLUMNS = ('reg_num', 'firstname', 'lastname', 'department', 'level', 'phone_number')
+REQUIRED_COLUMNS = ('reg_num', 'firstname', 'lastname', 'department', 'level')
+
+
+class ImportReport:
+    """Outcome of a roster import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        # (line, reg_num, message)
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def error(self, line, reg_num, message):
+        self.errors.append((line, reg_num, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def invalid(self):
+        return len(self.errors) - self.duplicates
+
+    def summary(self):
+        return (
+            f"{self.rows} rows read, {self.imported} students imported, "
+            f"{self.duplicates} duplicates, {self.invalid} invalid rows "
+            f"in {self.elapsed:.2f}s ({self.rows_per_second:.0f} rows/s)"
+        )
+
+
+def read_roster(fileobj):
+    """
+    Yields (line, row) from a roster csv, row values are stripped
+
+    The first line must be a header naming at least REQUIRED_COLUMNS
+    """
+    reader = csv.DictReader(fileobj)
+    header = [name.strip().lower() for name in reader.fieldnames or ()]
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise ValueError(f"Roster is missing the {', '.join(missing)} column(s)")
+    reader.fieldnames = header
+    for row in reader:
+        yield reader.line_num, {
+            name: (row.get(name) or '').strip()
+            for name in ROSTER_COLUMNS
+        }
+
+
+def _enrolled(reg_nums):
+    stmt = select(Student.reg_num).where(Student.reg_num.in_(reg_nums))
+    return set(db_session.execute(stmt).scalars())
+
+
+def _import_batch(batch, seen, report):
+    valid = []
+    results = STUDENT_SCHEMA.validate_many([row for _, row in batch])
+    for (line, row), (values, errors) in zip(batch, results):
+        if errors:
+            report.error(line, row['reg_num'], "; ".join(errors))
+        elif values['reg_num'] in seen:
+            report.duplicates += 1
+            report.error(line, row['reg_num'], "appears earlier in the file")
+        else:
+            seen.add(values['reg_num'])
+            valid.append((line, values))
+    if not valid:
+        return
+
+    # a student may enroll between the check and the insert,
+    # check again if the insert clashes, then fall back to row by row
+    for attempt in range(2):
+        enrolled = _enrolled([row['reg_num'] for _, row in valid])
+        for line, row in valid:
+            if row['reg_num'] in enrolled:
+                report.duplicates += 1
+                report.error(line, row['reg_num'], "already enrolled")
+        valid = [(line, row) for line, row in valid if row['reg_num'] not in enrolled]
+        if not valid:
+            db_session.rollback()
+            return
+
+        values = [row for _, row in valid]
+        try:
+            db_session.execute(insert(Student), values)
+            db_session.commit()
+        except IntegrityError:
+            db_session.rollback()
+        else:
+            report.imported += len(values)
+            return
+    _insert_each(valid, report)
+
+
+def _insert_each(valid, report):
+    # one transaction per row, a row that still clashes is reported
+    for line, row in valid:
+        try:
+            db_session.execute(insert(Student), [row])
+            db_session.commit()
+        except IntegrityError:
+            db_session.rollback()
+            report.duplicates += 1
+            report.error(line, row['reg_num'], "already enrolled")
+        else:
+            report.imported += 1
+
+
+def import_students(fileobj, batch_size=1000):
+    """
+    Enrolls the students listed in a roster csv (a text file object)
+
+    Invalid and duplicate rows are skipped and reported, the rest are
+    inserted batch_size rows per transaction. Returns an ImportReport.
+    """
+    report = ImportReport()
+    rows = read_roster(fileobj)
+    seen = set()
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        report.rows += len(batch)
+        _import_batch(batch, seen, report)
+    report.errors.sort()
+    report.elapsed = time.perf_counter() - report.started
+    return report
+
+
+def write_error_report(report, fileobj):
+    """Writes the rejected rows of report to fileobj as csv"""
+    writer = csv.writer(fileobj)
+    writer.writerow(('line', 'reg_num', 'error'))
+    writer.writerows(report.errors)
@@ -0,0 +1,117 @@
+# opens and closes events on schedule
+#
+# runs as `flask run-scheduler` or as a thread of the app process
+# (RUN_SCHEDULER = True), every SCHEDULER_INTERVAL seconds it makes
+# classes that reached their start time visible and closes classes that
+# have been open for EVENT_DURATION seconds
+
+from sqlalchemy import select
+
+from .models import Event
+from .db import db_session
+from .events import close_event, invalidate_current_event
+
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# held by the scheduler doing the current tick, so several app processes
+# running the scheduler thread do not all open and close the same events
+SCHEDULER_LOCK_KEY = "scheduler:lock"
+
+
+def events_to_open(since, now):
+    """Events that reached their start time after since"""
+    stmt = select(Event).where(
+        Event.closed == False,
+        Event.date > since,
+        Event.date <= now,
+    )
+    return db_session.execute(stmt).scalars().all()
+
+
+def events_to_close(now, duration):
+    """Open events that started at least duration (seconds) ago"""
+    stmt = select(Event).where(
+        Event.closed == False,
+        Event.date <= now - timedelta(seconds=duration),
+    )
+    return db_session.execute(stmt).scalars().all()
+
+
+def run_once(app, since, now=None):
+    """
+    Opens the events that started after since and closes the events that
+    are due, returns (opened, closed) event ids
+
+    Must be called within an app context.
+    """
+    now = now or datetime.now()
+    opened, closed = [], []
+
+    for event in events_to_open(since, now):
+        # the cached "no event today" would hide it until it expires
+        invalidate_current_event(event.date.date())
+        opened.append(event.id)
+
+    for event in events_to_close(now, app.config["EVENT_DURATION"]):
+        close_event(event)
+        closed.append(event.id)
+
+    return opened, closed
+
+
+class Scheduler:
+    """Calls run_once every interval seconds on a daemon thread"""
+
+    def __init__(self, app, interval=None):
+        self.app = app
+        self.interval = interval or app.config["SCHEDULER_INTERVAL"]
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_run = None
+
+    def _acquire(self):
+        # expires before the next tick, whichever process ticks first runs it
+        ttl = max(int(self.interval * 900), 1)
+        return self.app.broker.set(SCHEDULER_LOCK_KEY, 1, nx=True, px=ttl)
+
+    def tick(self):
+        """Runs one round if no other scheduler holds the lock, returns (opened, closed)"""
+        now = datetime.now()
+        since = self._last_run or now - timedelta(seconds=self.interval)
+        if not self._acquire():
+            return [], []
+        with self.app.app_context():
+            opened, closed = run_once(self.app, since, now)
+        self._last_run = now
+        if opened or closed:
+            logger.info("Opened events %r, closed events %r", opened, closed)
+        return opened, closed
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="event-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def init_app(app):
+    """Starts the scheduler thread in this process"""
+    app.scheduler = Scheduler(app)
+    app.scheduler.start()
@@ -0,0 +1,53 @@
+# live attendance over socket.io, one room per event
+#
+# enabled with LIVE_UPDATE_MODE = "socketio", idle viewers then cost a
+# socket (a green thread with eventlet or gevent) instead of a worker thread
+
+from flask import current_app, session
+from flask_socketio import SocketIO, join_room
+
+from .events import get_current_event
+from .feed import unpack_update, split_closed
+
+
+NAMESPACE = "/live-attendance"
+
+socketio = SocketIO()
+
+
+def event_room(event_id):
+    return f"event-{event_id}"
+
+
+@socketio.on("connect", namespace=NAMESPACE)
+def connect(auth=None):
+    # before_request hooks do not run for socket.io handlers,
+    # so check the admin session directly
+    if session.get("admin") is None:
+        return False
+
+    event = get_current_event()
+    if event is None:
+        return False
+    join_room(event_room(event.id))
+
+
+def forward_updates(event_id, updates):
+    """Broadcaster listener, emits attendance records to the event's room"""
+    updates, closed = split_closed([unpack_update(update) for update in updates])
+    records = [record for _, record in updates]
+    room = event_room(event_id)
+    if len(records) == 1:
+        socketio.emit("new_attendance", records[0].decode(), to=room, namespace=NAMESPACE)
+    elif records:
+        batch = b"[" + b",".join(records) + b"]"
+        socketio.emit("new_attendance_batch", batch.decode(), to=room, namespace=NAMESPACE)
+    if closed:
+        socketio.emit("closed", to=room, namespace=NAMESPACE)
+        socketio.close_room(room, namespace=NAMESPACE)
+
+
+def init_app(app):
+    socketio.init_app(app, async_mode=app.config["SOCKETIO_ASYNC_MODE"])
+    # socket.io viewers share the process's redis subscription
+    app.broadcaster.add_listener(forward_updates)
@@ -0,0 +1,100 @@
+# per-student attendance statistics
+#
+# StudentStats rows are kept up to date as attendance is taken, the
+# functions here read them and rebuild them from the attendance table
+
+from sqlalchemy import select, delete, insert, func
+
+from .models import Attendance, Event, Student, StudentStats
+from .db import db_session, iter_rows
+
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+
+def events_held():
+    """Number of events that have started (a count over the event date index)"""
+    stmt = select(func.count()).select_from(Event).where(Event.date <= datetime.now())
+    return db_session.execute(stmt).scalar()
+
+
+def student_stats(student_id):
+    """Returns the student's StudentStats (None if never attended)"""
+    return db_session.get(StudentStats, student_id)
+
+
+def rankings(limit=50):
+    """Returns (StudentStats, Student) of the most regular students"""
+    stmt = (
+        select(StudentStats, Student)
+        .join(Student, StudentStats.student_id == Student.id)
+        .order_by(StudentStats.attended.desc(), StudentStats.longest_streak.desc())
+        .limit(limit)
+    )
+    return db_session.execute(stmt).all()
+
+
+def _summarise(student_id, attended, position, last_closed):
+    # attended: [(event_id, arrival_time)] in event order
+    positions = [position[event_id] for event_id, _ in attended]
+    longest = run = 1
+    for previous, current in zip(positions, positions[1:]):
+        run = run + 1 if current == previous + 1 else 1
+        longest = max(longest, run)
+
+    # a streak is over once a later event closed without the student
+    current_streak = run if last_closed <= positions[-1] else 0
+    last_event_id, last_seen = attended[-1]
+    return dict(
+        student_id=student_id,
+        attended=len(attended),
+        current_streak=current_streak,
+        longest_streak=longest,
+        last_seen=last_seen,
+        last_event_id=last_event_id,
+    )
+
+
+def rebuild_stats(batch_size=1000, student_ids=None):
+    """
+    Recomputes every student's summary from the attendance table, or
+    only the summaries of student_ids
+
+    Attendance is streamed in student order, summaries are inserted in
+    batches of batch_size. Returns the number of students summarised.
+    """
+    now = datetime.now()
+    events = db_session.execute(
+        select(Event.id, Event.closed).where(Event.date <= now).order_by(Event.date, Event.id)
+    ).all()
+    position = {event_id: n for n, (event_id, _) in enumerate(events)}
+    last_closed = max((n for n, (_, closed) in enumerate(events) if closed), default=-1)
+
+    rows = (
+        select(Attendance.student_id, Attendance.event_id, Attendance.arrival_time)
+        .join(Event, Attendance.event_id == Event.id)
+        .where(Event.date <= now)
+        .order_by(Attendance.student_id, Event.date, Event.id)
+    )
+
+    clear = delete(StudentStats)
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        rows = rows.where(Attendance.student_id.in_(student_ids))
+        clear = clear.where(StudentStats.student_id.in_(student_ids))
+
+    db_session.execute(clear)
+    summaries = []
+    count = 0
+    for student_id, group in groupby(iter_rows(rows), key=itemgetter(0)):
+        attended = [(event_id, arrival_time) for _, event_id, arrival_time in group]
+        summaries.append(_summarise(student_id, attended, position, last_closed))
+        count += 1
+        if len(summaries) >= batch_size:
+            db_session.execute(insert(StudentStats), summaries)
+            summaries = []
+    if summaries:
+        db_session.execute(insert(StudentStats), summaries)
+    db_session.commit()
+    return count
@@ -0,0 +1,119 @@
+# student field validation
+#
+# STUDENT_SCHEMA is the one set of rules for student data, used by the
+# enrollment and profile forms, the roster import and
+# the Student model's @validates hooks. Patterns are compiled once and a
+# schema validates a whole dict, or a batch of dicts, in one pass.
+
+import re
+
+
+# 080..., 081..., 090..., 091..., 070..., 071... followed by 8 digits
+PHONE_NUMBER_PATTERN = re.compile(r"0[789][01]\d{8}")
+# 201X/XXXXXX or 202X/XXXXXX (all 200X should have graduated)
+REG_NUM_PATTERN = re.compile(r"20[1-2][0-9]/\d{6}")
+VALID_LEVELS = (100, 200, 300, 400, 500)
+
+
+def clean_reg_num(reg_num):
+    if REG_NUM_PATTERN.fullmatch(reg_num) is None:
+        raise ValueError(f"{reg_num!r} is not valid, (should be 201X/XXXX or 202X/XXXXXX)")
+    return reg_num
+
+
+def clean_phone_number(phone_number):
+    if PHONE_NUMBER_PATTERN.fullmatch(phone_number) is None:
+        raise ValueError(f"{phone_number!r} does not seem to be valid. (should be in the format 080XXXXXXXX)")
+    return phone_number
+
+
+def clean_level(level):
+    """Returns level as an int, forms and csv files send it as a string"""
+    try:
+        value = int(level)
+    except (TypeError, ValueError):
+        value = None
+    if value not in VALID_LEVELS:
+        raise ValueError(f"{level!r} is not a valid level, select any of {list(VALID_LEVELS)!r}")
+    return value
+
+
+class Field:
+    """
+    A field of a schema
+
+    clean(value) returns the value to store or raises ValueError with the
+    message to show, it is called with non-empty values only. Values must
+    be strings, a numeric field takes ints too
+    """
+
+    def __init__(self, required=True, max_length=None, clean=None, numeric=False):
+        self.required = required
+        self.max_length = max_length
+        self.clean = clean
+        self.numeric = numeric
+
+    def check(self, name, value):
+        """Returns the cleaned value of field name, raises ValueError if invalid"""
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            if self.required:
+                raise ValueError(f"{name} is required")
+            return None
+        if not isinstance(value, str):
+            # bool is an int, but never a valid number here
+            if not self.numeric or not isinstance(value, int) or isinstance(value, bool):
+                kind = "a string or a number" if self.numeric else "a string"
+                raise ValueError(f"{name} must be {kind}")
+        if self.max_length and len(str(value)) > self.max_length:
+            raise ValueError(f"{name} is longer than {self.max_length} characters")
+        if self.clean is not None:
+            value = self.clean(value)
+        return value
+
+
+class Schema:
+    """A set of named fields validated together"""
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self._items = tuple(fields.items())
+
+    def check(self, name, value):
+        """Returns the cleaned value of one field, raises ValueError if invalid"""
+        return self.fields[name].check(name, value)
+
+    def validate(self, data, partial=False):
+        """
+        Returns (values, errors) for a mapping such as a form
+
+        values holds the cleaned value of each valid field, errors a message
+        per invalid field. With partial, fields missing from data are skipped.
+        """
+        values = {}
+        errors = []
+        for name, field in self._items:
+            if partial and name not in data:
+                continue
+            try:
+                values[name] = field.check(name, data.get(name))
+            except ValueError as e:
+                errors.append(str(e))
+        return values, errors
+
+    def validate_many(self, rows, partial=False):
+        """Returns [(values, errors)] for each mapping in rows"""
+        validate = self.validate
+        return [validate(row, partial) for row in rows]
+
+
+# lengths match the student table columns
+STUDENT_SCHEMA = Schema(
+    reg_num=Field(max_length=11, clean=clean_reg_num),
+    firstname=Field(max_length=30),
+    lastname=Field(max_length=30),
+    department=Field(max_length=15),
+    level=Field(clean=clean_level, numeric=True),
+    phone_number=Field(required=False, max_length=11, clean=clean_phone_number),
+)
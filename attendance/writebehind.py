@@ -0,0 +1,264 @@
+# write-behind attendance
+#
+# with ATTENDANCE_WRITE_MODE = "write-behind" a tap is recorded on the
+# broker only: the student is added to the event's marked set (which rejects
+# repeat taps), the attendance is appended to a queue stream and the
+# record is published to live viewers, all in one script call for a whole
+# batch of taps (an API kiosk batch is one broker round trip). The
+# attendance writer (`flask run-attendance-writer`) reads the queue
+# through a consumer group and saves it to the database in batches,
+# entries are acknowledged only after their batch is committed so a
+# writer that crashes replays them when it restarts
+
+from flask import current_app, has_app_context
+from sqlalchemy import select
+
+from .models import Attendance, Event, StudentStats
+from .db import db_session
+from .feed import feed_key, update_channel, load_script, push_record_fallback
+from .analytics import summary_key
+from .stats import rebuild_stats
+
+from datetime import datetime, time
+import contextlib
+import logging
+import socket
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+MARKED_KEY = "attendance:{event_id}:marked"
+QUEUE_KEY = "attendance:queue"
+WRITER_GROUP = "attendance-writers"
+
+
+def marked_key(event_id):
+    return MARKED_KEY.format(event_id=event_id)
+
+
+def is_marked(event_id, student_id):
+    """Whether the student's attendance at event is known to be taken"""
+    return current_app.broker.sismember(marked_key(event_id), student_id)
+
+
+def add_marked(event_id, *student_ids):
+    """Adds students whose attendance was saved to the event's marked set"""
+    if not student_ids:
+        return
+    broker = current_app.broker
+    key = marked_key(event_id)
+    broker.sadd(key, *student_ids)
+    broker.expire(key, current_app.config["FEED_TTL"])
+
+
+# for each tap (student_id, arrival_time, record) adds the student to the
+# marked set, a student already in it is skipped, otherwise queues the
+# attendance and pushes the record to the feed as PUSH_RECORD_SCRIPT does.
+# Returns the ids of the students queued
+QUEUE_ATTENDANCE_SCRIPT = """
+local queued = {}
+for i = 5, #ARGV, 3 do
+    local student_id, record = ARGV[i], ARGV[i + 2]
+    if redis.call('SADD', KEYS[1], student_id) == 1 then
+        redis.call('XADD', KEYS[2], '*', 'event_id', ARGV[1], 'student_id', student_id, 'arrival_time', ARGV[i + 1])
+        local record_id = redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[2], '*', 'record', record)
+        redis.call('PUBLISH', KEYS[4], record_id .. ' ' .. record)
+        queued[#queued + 1] = student_id
+    end
+end
+if #queued > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[3], ARGV[3])
+end
+return queued
+"""
+
+
+def _queue_attendance(broker, keys, args):
+    # QUEUE_ATTENDANCE_SCRIPT for brokers without lua
+    marked, queue, feed, channel = keys
+    event_id, maxlen, feed_ttl, marked_ttl, *taps = args
+    queued = []
+    records = []
+    for i in range(0, len(taps), 3):
+        student_id, arrival_time, record = taps[i:i + 3]
+        if not broker.sadd(marked, student_id):
+            continue
+        broker.xadd(queue, {"event_id": event_id, "student_id": student_id, "arrival_time": arrival_time})
+        queued.append(student_id)
+        records.append(record)
+    if queued:
+        broker.expire(marked, int(marked_ttl))
+        push_record_fallback(broker, [feed, channel], [maxlen, feed_ttl, *records])
+    return queued
+
+
+def queue_attendance(event_id, taps):
+    """
+    Records taps, [(student_id, arrival_time, record)], at event on the
+    broker and publishes their records, in one broker call
+
+    Returns the set of student ids queued, the others had their attendance
+    taken already
+    """
+    if not taps:
+        return set()
+    script = load_script("queue_attendance_script", QUEUE_ATTENDANCE_SCRIPT, _queue_attendance)
+    config = current_app.config
+    args = [event_id, config["FEED_MAX_LENGTH"], config["FEED_TTL"], config["FEED_TTL"]]
+    for student_id, arrival_time, record in taps:
+        args += [student_id, arrival_time.isoformat(), record]
+    queued = script(
+        keys=[marked_key(event_id), QUEUE_KEY, feed_key(event_id), update_channel(event_id)],
+        args=args,
+    )
+    return {int(student_id) for student_id in queued}
+
+
+class AttendanceWriter:
+    """
+    Saves queued attendance to the database
+
+    Entries are read through the consumer group a batch at a time. A
+    batch is written in one transaction, with one executemany per event
+    and table, and acknowledged once it is committed. Attendance.record_many
+    skips rows that were already saved, so replaying a batch is harmless.
+    """
+
+    def __init__(self, app, consumer=None, batch_size=None):
+        self.app = app
+        self.broker = app.broker
+        # a stable name lets a restarted writer pick up its own pending entries
+        self.consumer = consumer or f"{socket.gethostname()}-writer"
+        self.batch_size = batch_size or app.config["WRITE_BEHIND_BATCH_SIZE"]
+        self._stop = threading.Event()
+
+    def _ensure_group(self):
+        self.broker.group_create(QUEUE_KEY, WRITER_GROUP)
+
+    def save(self, entries):
+        """Writes a batch of queue entries in one transaction, returns the number of new rows"""
+        if not entries:
+            return 0
+        arrivals = {}  # event_id: [(student_id, arrival_time)]
+        for _, fields in entries:
+            if fields is None:
+                # deleted from the stream while pending
+                continue
+            arrivals.setdefault(int(fields[b"event_id"]), []).append((
+                int(fields[b"student_id"]),
+                datetime.fromisoformat(fields[b"arrival_time"].decode()),
+            ))
+
+        recorded = {}
+        with self._app_context():
+            # one executemany per event and table
+            for event_id, rows in arrivals.items():
+                recorded[event_id] = Attendance.record_many(event_id, rows)
+                StudentStats.record_attendances(event_id, [row for row in rows if row[0] in recorded[event_id]])
+            db_session.commit()
+            self._settle_late(recorded)
+
+        self.broker.group_ack(QUEUE_KEY, WRITER_GROUP, [entry_id for entry_id, _ in entries])
+        return sum(len(student_ids) for student_ids in recorded.values())
+
+    def _app_context(self):
+        # the caller's context when there is one (close_event), popping a
+        # context of our own would remove the caller's session
+        if has_app_context():
+            return contextlib.nullcontext()
+        return self.app.app_context()
+
+    def _settle_late(self, recorded):
+        """
+        Fixes up attendance committed after its event closed
+
+        close_event saves the queue first, but a batch another writer was
+        still saving misses the close: end_streaks reset its students'
+        streaks and the event's summary may be cached as final. Their
+        stats are recounted from the attendance table and the summary is
+        dropped, which is also right if the close came after the commit.
+        """
+        event_ids = [event_id for event_id, student_ids in recorded.items() if student_ids]
+        if not event_ids:
+            return
+        today_start = datetime.combine(datetime.now().date(), time.min)
+        events = db_session.execute(
+            select(Event.id, Event.closed, Event.date).where(Event.id.in_(event_ids))
+        ).all()
+        closed = [event_id for event_id, is_closed, _ in events if is_closed]
+        final = [event_id for event_id, is_closed, date in events if is_closed or date < today_start]
+        if closed:
+            rebuild_stats(student_ids=set().union(*(recorded[event_id] for event_id in closed)))
+        if final:
+            self.broker.delete(*(summary_key(event_id) for event_id in final))
+
+    def replay(self):
+        """
+        Saves entries read but never acknowledged, this writer's own and
+        those of writers idle for WRITE_BEHIND_CLAIM_IDLE seconds
+        """
+        self._ensure_group()
+        saved = 0
+        while True:
+            entries = self._read("0")
+            if not entries:
+                break
+            saved += self.save(entries)
+
+        idle = int(self.app.config["WRITE_BEHIND_CLAIM_IDLE"] * 1000)
+        start = "0-0"
+        while True:
+            start, entries = self.broker.group_claim(
+                QUEUE_KEY, WRITER_GROUP, self.consumer, idle, start=start, count=self.batch_size
+            )
+            saved += self.save(entries)
+            if start in (b"0-0", "0-0"):
+                break
+        return saved
+
+    def _read(self, last_id, block=None):
+        return self.broker.group_read(
+            QUEUE_KEY, WRITER_GROUP, self.consumer, last_id, count=self.batch_size, block=block
+        )
+
+    def drain(self, block=1000):
+        """Saves the next batch of new entries, waits up to block milliseconds for one"""
+        return self.save(self._read(">", block=block))
+
+    def flush(self):
+        """Saves everything queued so far, returns the number of new rows"""
+        saved = self.replay()
+        while True:
+            entries = self._read(">")
+            if not entries:
+                return saved
+            saved += self.save(entries)
+
+    def run(self):
+        failed = True
+        while not self._stop.is_set():
+            try:
+                if failed:
+                    logger.info("Replayed %d queued attendance records", self.replay())
+                    failed = False
+                self.drain()
+            except Exception:
+                # the batch stays pending and is replayed
+                logger.exception("Saving queued attendance failed")
+                failed = True
+                self._stop.wait(1)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="attendance-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def init_app(app):
+    """Starts the attendance writer as a thread of this process"""
+    app.attendance_writer = AttendanceWriter(app)
+    app.attendance_writer.start()
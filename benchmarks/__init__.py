@@ -0,0 +1,2 @@
+# benchmarks for the attendance hot paths
+# run from the repository root, e.g: python -m benchmarks.mark_attendance
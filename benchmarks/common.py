@@ -0,0 +1,63 @@
+# shared helpers for benchmarks
+
+from sqlalchemy import event
+
+from pathlib import Path
+import tempfile
+
+
+def use_temp_database():
+    """
+    Points the app at an empty sqlite database in a temporary directory
+
+    Must be called before attendance.db is imported
+    """
+    from attendance import settings
+    tmpdir = tempfile.mkdtemp(prefix="attendance-bench-")
+    settings.DATABASE = Path(tmpdir) / "bench.sqlite"
+
+    from attendance.db import init_db
+    init_db()
+    return settings.DATABASE
+
+
+class QueryCounter:
+    """Counts statements sent to the database through engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_execute(self, *args):
+        self.statements += 1
+
+    def _on_commit(self, *args):
+        self.commits += 1
+
+    def reset(self):
+        self.statements = 0
+        self.commits = 0
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+        event.remove(self.engine, "commit", self._on_commit)
+
+
+def seed(db_session, students=500):
+    """Adds an admin, an event and students, returns (event, students)"""
+    from attendance.models import Admin, Event, Student
+    from datetime import datetime
+
+    admin = Admin("bench", "admin", "bench", "not-a-hash")
+    event = Event(datetime.now())
+    event.admin = admin
+    rows = [
+        Student(f"2019/{n:06d}", f"first{n}", f"last{n}", "ECE", "400")
+        for n in range(students)
+    ]
+    db_session.add_all([admin, event, *rows])
+    db_session.commit()
+    return event, rows
@@ -0,0 +1,127 @@
+"""
+Admin dashboard analytics over a year of classes
+
+Seeds one class a day for --days days (today's still open) with
+--students students attending about 80% of them, then times
+analytics.dashboard_data with an empty summary cache (cold), with the
+closed classes cached (warm), and a baseline that loads the attendance
+rows as ORM objects and counts them in python.
+
+    python -m benchmarks.dashboard [--days 365] [--students 300] [--broker redis]
+
+Runs on the in-process broker unless --broker redis is given, the
+benchmark's summary keys are deleted before and after the run.
+"""
+from sqlalchemy import insert, select
+from sqlalchemy.orm import selectinload
+
+from .common import use_temp_database, QueryCounter
+
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+import argparse
+import random
+import statistics
+import timeit
+
+
+def seed_year(db_session, days, students):
+    from attendance.models import Admin, Attendance, Event, Student
+
+    admin = Admin("bench", "admin", "bench", "not-a-hash")
+    db_session.add(admin)
+    db_session.flush()
+
+    departments = ["ECE", "CSC", "MEE", "CVE"]
+    db_session.execute(insert(Student), [
+        dict(reg_num=f"2019/{n:06d}", firstname=f"first{n}", lastname=f"last{n}",
+             department=departments[n % 4], level=100 * (n % 5 + 1))
+        for n in range(students)
+    ])
+
+    today = datetime.combine(datetime.now().date(), time(9))
+    event_dates = [today - timedelta(days=n) for n in range(days)]
+    db_session.execute(insert(Event), [
+        dict(date=date, created_by=admin.id, closed=date < today)
+        for date in event_dates
+    ])
+    event_ids = [event_id for event_id, in db_session.query(Event.id).order_by(Event.id)]
+
+    random.seed(1)
+    for event_id, date in zip(event_ids, event_dates):
+        db_session.execute(insert(Attendance), [
+            dict(event_id=event_id, student_id=student_id,
+                 arrival_time=date + timedelta(minutes=random.gauss(10, 12)))
+            for student_id in range(1, students + 1)
+            if random.random() < 0.8
+        ])
+    db_session.commit()
+    return event_ids
+
+
+def orm_dashboard(db_session):
+    # loads every attendance row and student as objects
+    from attendance.models import Attendance, Event
+
+    departments, levels, totals = Counter(), Counter(), []
+    events = db_session.query(Event).order_by(Event.date).all()
+    # what selectinload(Event.attendance) did before the collection was
+    # made write-only, every event's attendance loaded in one IN query
+    by_event = defaultdict(list)
+    for attendance in db_session.scalars(
+        select(Attendance)
+        .where(Attendance.event_id.in_([event.id for event in events]))
+        .options(selectinload(Attendance.student))
+    ):
+        by_event[attendance.event_id].append(attendance)
+    for event in events:
+        totals.append(len(by_event[event.id]))
+        for attendance in by_event[event.id]:
+            departments[attendance.student.department] += 1
+            levels[attendance.student.level] += 1
+    return totals, departments, levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admin dashboard analytics over a year of classes")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--broker", choices=["memory", "redis"], default="memory",
+                        help="redis uses the server configured in settings.py")
+    args = parser.parse_args()
+
+    use_temp_database()
+    from attendance import create_app
+    from attendance.analytics import dashboard_data, summary_key
+    from attendance.db import db_session
+
+    app = create_app({"TESTING": True, "BROKER": args.broker})
+    with app.app_context():
+        event_ids = seed_year(db_session, args.days, args.students)
+        keys = [summary_key(event_id) for event_id in event_ids]
+        app.broker.delete(*keys)
+        counter = QueryCounter(db_session.get_bind())
+
+        def timed(fn, repeat):
+            runs = []
+            for _ in range(repeat):
+                db_session.remove()
+                counter.reset()
+                runs.append(timeit.timeit(fn, number=1) * 1000)
+            return statistics.median(runs), counter.statements
+
+        try:
+            cold = timed(dashboard_data, 1)
+            warm = timed(dashboard_data, args.repeat)
+            orm = timed(lambda: orm_dashboard(db_session), 3)
+        finally:
+            app.broker.delete(*keys)
+            counter.close()
+
+        for name, (ms, statements) in (("sql cold", cold), ("sql warm", warm), ("orm", orm)):
+            print(f"{name:<9} ms={ms:.1f} statements={statements}")
+
+
+if __name__ == "__main__":
+    main()
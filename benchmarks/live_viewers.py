@@ -0,0 +1,183 @@
+"""
+Concurrent live attendance viewers held by a running server
+
+Logs in as an admin, opens --viewers idle live attendance connections
+(the SSE route, or socket.io when the server runs with
+LIVE_UPDATE_MODE = "socketio"), then publishes a probe record on redis
+and measures how many viewers receive it and how long it takes.
+
+    python -m benchmarks.live_viewers --url http://localhost:5000 \\
+        --username admin --password secret --event-id 1 --mode sse --viewers 1000
+
+The socket.io mode needs the aiohttp package for python-socketio's
+asyncio client. Raise the open file limit (ulimit -n) for large runs.
+"""
+from redis import Redis
+
+from attendance.feed import pack_update, update_channel
+
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode, urlsplit
+import urllib.request
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+
+SSE_PATH = "/admin/live-attendance-update"
+NAMESPACE = "/live-attendance"
+
+
+def login(url, username, password):
+    """Returns the session cookie header of a logged in admin"""
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urlencode({"username": username, "password": password}).encode()
+    opener.open(f"{url}/admin/login", data=data)
+    cookies = "; ".join(f"{cookie.name}={cookie.value}" for cookie in jar)
+    if "session=" not in cookies:
+        raise SystemExit("Could not log in as admin")
+    return cookies
+
+
+class Viewer:
+    def __init__(self):
+        self.connected = False
+        self.received = {}  # probe id: receive time
+
+    def on_record(self, data):
+        records = json.loads(data)
+        # batches are arrays of records
+        for record in records if isinstance(records, list) else [records]:
+            probe = record.get("probe")
+            if probe:
+                self.received[probe] = time.perf_counter()
+
+
+async def sse_viewer(viewer, url, cookies, stop):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    writer.write((
+        f"GET {SSE_PATH} HTTP/1.1\r\n"
+        f"Host: {parts.netloc}\r\n"
+        f"Cookie: {cookies}\r\n"
+        "Accept: text/event-stream\r\n\r\n"
+    ).encode())
+    await writer.drain()
+    status = await reader.readline()
+    if b" 200 " not in status:
+        writer.close()
+        return
+    viewer.connected = True
+    try:
+        while not stop.is_set():
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b"data:"):
+                viewer.on_record(line[5:])
+    finally:
+        viewer.connected = False
+        writer.close()
+
+
+async def socketio_viewer(viewer, url, cookies, stop):
+    import socketio
+
+    client = socketio.AsyncClient(reconnection=False)
+    client.on("new_attendance", viewer.on_record, namespace=NAMESPACE)
+    client.on("new_attendance_batch", viewer.on_record, namespace=NAMESPACE)
+    await client.connect(url, namespaces=[NAMESPACE], headers={"Cookie": cookies}, transports=["websocket"])
+    viewer.connected = True
+    try:
+        await stop.wait()
+    finally:
+        viewer.connected = False
+        await client.disconnect()
+
+
+async def open_viewer(viewer, connect, url, cookies, stop, failures):
+    try:
+        await connect(viewer, url, cookies, stop)
+    except Exception as e:
+        failures.append(repr(e))
+
+
+async def run(args):
+    cookies = login(args.url, args.username, args.password)
+    connect = sse_viewer if args.mode == "sse" else socketio_viewer
+    stop = asyncio.Event()
+    failures = []
+    viewers = [Viewer() for _ in range(args.viewers)]
+
+    start = time.perf_counter()
+    tasks = []
+    for n, viewer in enumerate(viewers):
+        tasks.append(asyncio.create_task(open_viewer(viewer, connect, args.url, cookies, stop, failures)))
+        # ramp up in steps so the accept queue is not flooded
+        if n % args.ramp == args.ramp - 1:
+            await asyncio.sleep(0.1)
+
+    # wait for connections to settle
+    deadline = time.perf_counter() + args.settle
+    while time.perf_counter() < deadline:
+        if sum(v.connected for v in viewers) + len(failures) >= args.viewers:
+            break
+        await asyncio.sleep(0.1)
+    ramp_time = time.perf_counter() - start
+    connected = sum(v.connected for v in viewers)
+
+    # publish a probe and wait for it to arrive
+    redis = Redis.from_url(args.redis_url)
+    probe = uuid.uuid4().hex
+    record = json.dumps({"reg_num": "probe", "firstname": "", "lastname": "",
+                         "department": "", "arrival_time": "", "probe": probe})
+    sent = time.perf_counter()
+    redis.publish(update_channel(args.event_id), pack_update("0-1", record))
+    deadline = sent + args.settle
+    while time.perf_counter() < deadline:
+        if sum(probe in v.received for v in viewers) >= connected:
+            break
+        await asyncio.sleep(0.05)
+
+    delays = sorted((v.received[probe] - sent) * 1000 for v in viewers if probe in v.received)
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    result = {
+        "mode": args.mode,
+        "viewers": args.viewers,
+        "connected": connected,
+        "failed": len(failures),
+        "ramp_seconds": round(ramp_time, 2),
+        "received": len(delays),
+        "delivery_ms_p50": round(statistics.median(delays), 2) if delays else None,
+        "delivery_ms_max": round(delays[-1], 2) if delays else None,
+    }
+    print(json.dumps(result))
+    if failures:
+        print("first failure:", failures[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent live attendance viewers held by a running server")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--event-id", type=int, required=True, help="id of today's open event")
+    parser.add_argument("--mode", choices=["sse", "socketio"], default="sse")
+    parser.add_argument("--viewers", type=int, default=500)
+    parser.add_argument("--ramp", type=int, default=100, help="connections opened per 100ms")
+    parser.add_argument("--settle", type=float, default=30, help="seconds to wait for connections and delivery")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+End-to-end load test of the attendance hot paths
+
+Runs the app in process against a temporary SQLite database and the
+in-process broker (or the configured redis server with --broker redis).
+--admins admins hold live attendance streams open while --students
+students, spread over --clients threads, log in through auth.login and
+mark attendance.
+
+Reports, per endpoint, requests per second, p50/p95/p99 latency and SQL
+statements per request, and the delay from a student's tap to the record
+reaching each live stream. --json writes the results (with the commit
+they were measured on) for comparing runs, --compare prints the change
+against an earlier results file.
+
+    python -m benchmarks.load [--students 500] [--clients 8] [--admins 5] \\
+        [--json results.json] [--compare baseline.json]
+"""
+from sqlalchemy import event
+
+from .common import use_temp_database, seed
+
+from flask import has_request_context, request
+
+from collections import defaultdict
+import argparse
+import json
+import subprocess
+import threading
+import time
+
+
+def percentile(values, p):
+    """p-th percentile of sorted values (nearest rank)"""
+    if not values:
+        return None
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class EndpointQueryCounter:
+    """Counts statements sent to the database per request endpoint"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = defaultdict(int)
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        endpoint = request.endpoint if has_request_context() else None
+        with self._lock:
+            self.statements[endpoint] += 1
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+class Timings:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # endpoint: [ms]
+        self.errors = defaultdict(int)
+        self.tapped = {}  # reg_num: tap start (perf_counter)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, ms, ok):
+        with self._lock:
+            self.latencies[endpoint].append(ms)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def student(app, reg_nums, timings):
+    client = app.test_client()
+    for reg_num in reg_nums:
+        start = time.perf_counter()
+        response = client.post("/login", data={"reg_num": reg_num})
+        timings.add("auth.login", (time.perf_counter() - start) * 1000, response.status_code == 302)
+
+        start = time.perf_counter()
+        timings.tapped[reg_num] = start
+        response = client.get("/mark-attendance", headers={"Referer": "/profile"})
+        timings.add("register.mark_attendance", (time.perf_counter() - start) * 1000, response.status_code == 302)
+        client.get("/logout")
+
+
+def viewer(app, admin_identity, received, ready):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["admin"] = admin_identity
+    response = client.get(
+        "/admin/live-attendance-update", headers={"Referer": "/admin/"}, buffered=False
+    )
+    ready.release()
+    for chunk in response.response:
+        now = time.perf_counter()
+        for line in chunk.splitlines():
+            if line.startswith(b"event:closed"):
+                response.close()
+                return
+            if not line.startswith(b"data:"):
+                continue
+            records = json.loads(line[5:])
+            for record in records if isinstance(records, list) else [records]:
+                if "reg_num" in record:
+                    received[record["reg_num"]] = now
+
+
+def commit_id():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarise(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50), 2) if values else None,
+        "p95_ms": round(percentile(values, 95), 2) if values else None,
+        "p99_ms": round(percentile(values, 99), 2) if values else None,
+    }
+
+
+def run(args):
+    use_temp_database()
+    from attendance import create_app
+    from attendance.db import db_session
+    from attendance.events import close_event, invalidate_current_event
+    from attendance.identity import admin_identity
+    from attendance.models import Event
+
+    app = create_app({
+        "TESTING": True,
+        "BROKER": args.broker,
+        "LIVE_BATCH_WINDOW": args.batch_window,
+        # wake idle streams often so they notice the end of the run
+        "SSE_HEARTBEAT_INTERVAL": 1,
+        # every simulated student shares one address
+        "RATE_LIMIT_ENABLED": False,
+    })
+    with app.app_context():
+        bench_event, students = seed(db_session, args.students)
+        event_id = bench_event.id
+        admin = admin_identity(bench_event.admin)
+        reg_nums = [student.reg_num for student in students]
+        invalidate_current_event()
+        engine = db_session.get_bind()
+        db_session.remove()
+
+    counter = EndpointQueryCounter(engine)
+    timings = Timings()
+
+    ready = threading.Semaphore(0)
+    streams = [{} for _ in range(args.admins)]
+    viewers = [
+        threading.Thread(target=viewer, args=(app, admin, received, ready), daemon=True)
+        for received in streams
+    ]
+    for thread in viewers:
+        thread.start()
+    for _ in viewers:
+        ready.acquire()
+
+    students = [
+        threading.Thread(target=student, args=(app, reg_nums[n::args.clients], timings))
+        for n in range(args.clients)
+    ]
+    start = time.perf_counter()
+    for thread in students:
+        thread.start()
+    for thread in students:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # wait for the last records to reach the streams, then end them
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline:
+        if all(len(received) >= len(reg_nums) for received in streams):
+            break
+        time.sleep(0.05)
+    with app.app_context():
+        close_event(db_session.get(Event, event_id))
+    for thread in viewers:
+        thread.join(5)
+    counter.close()
+
+    endpoints = {}
+    for endpoint, latencies in sorted(timings.latencies.items()):
+        endpoints[endpoint] = dict(
+            summarise(latencies),
+            requests_per_second=round(len(latencies) / elapsed, 1),
+            errors=timings.errors[endpoint],
+            statements_per_request=round(counter.statements[endpoint] / len(latencies), 2),
+        )
+    delays = [
+        (received[reg_num] - timings.tapped[reg_num]) * 1000
+        for received in streams
+        for reg_num in received
+        if reg_num in timings.tapped
+    ]
+    return {
+        "commit": commit_id(),
+        "params": {
+            "students": args.students, "clients": args.clients, "admins": args.admins,
+            "broker": args.broker, "batch_window": args.batch_window,
+        },
+        "seconds": round(elapsed, 2),
+        "endpoints": endpoints,
+        "tap_to_stream": dict(
+            summarise(delays),
+            missing=args.admins * args.students - len(delays),
+        ),
+    }
+
+
+def compare(results, baseline):
+    """Prints the change of each latency and throughput figure against baseline"""
+    print(f"compared with {baseline.get('commit')}:")
+    sections = dict(results["endpoints"], tap_to_stream=results["tap_to_stream"])
+    before = dict(baseline["endpoints"], tap_to_stream=baseline["tap_to_stream"])
+    for name, figures in sections.items():
+        for key in ("p50_ms", "p95_ms", "p99_ms", "requests_per_second", "statements_per_request"):
+            new, old = figures.get(key), before.get(name, {}).get(key)
+            if new is None or not old:
+                continue
+            print(f"  {name:<26} {key:<22} {old:>9} -> {new:<9} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the attendance hot paths")
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent student threads")
+    parser.add_argument("--admins", type=int, default=5, help="live attendance streams held open")
+    parser.add_argument("--broker", choices=["memory", "redis"], default="memory",
+                        help="redis uses the server configured in settings.py")
+    parser.add_argument("--batch-window", type=float, default=0, help="LIVE_BATCH_WINDOW for the run")
+    parser.add_argument("--json", help="file to write the results to")
+    parser.add_argument("--compare", help="results file of an earlier run")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
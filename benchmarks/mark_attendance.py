@@ -0,0 +1,87 @@
+"""
+Queries per request for marking attendance
+
+Compares the previous ORM path (SELECT the attendance row, load the
+event's attendance list to append to it, commit) with Attendance.record_many (a single
+INSERT ... ON CONFLICT DO NOTHING). Every student taps twice, the
+second tap is a duplicate.
+
+    python -m benchmarks.mark_attendance [--students 500]
+"""
+from sqlalchemy import select
+
+from .common import use_temp_database, QueryCounter, seed
+
+from datetime import datetime
+import argparse
+import time
+
+
+def legacy_mark(db_session, Attendance, event, student):
+    # mark_attendance before Attendance.record_many
+    attendance_obj = Attendance.query.filter(
+            Attendance.student == student,
+            Attendance.event == event
+    ).first()
+    if attendance_obj is not None:
+        return False
+    attendance_obj = Attendance(event=event, student=student)
+    attendance_obj.arrival_time = datetime.now()
+    # event.attendance.append(attendance_obj) loaded the event's whole
+    # attendance list first, Event.attendance is write-only now so the
+    # load is spelled out (Attendance(event=event) already adds the row)
+    db_session.execute(select(Attendance).where(Attendance.event_id == event.id)).scalars().all()
+    db_session.add(attendance_obj)
+    db_session.commit()
+    return True
+
+
+def record_mark(db_session, Attendance, event, student):
+    created = Attendance.record_many(event.id, [(student.id, datetime.now())])
+    db_session.commit()
+    return bool(created)
+
+
+def run(name, mark, students):
+    from attendance.db import Base, db_session, engine
+    from attendance.models import Attendance, Event, Student
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    event, rows = seed(db_session, students)
+    event_id, student_ids = event.id, [s.id for s in rows]
+    db_session.remove()
+
+    counter = QueryCounter(engine)
+    for tap in ("first", "repeat"):
+        statements = commits = 0
+        start = time.perf_counter()
+        for student_id in student_ids:
+            # a fresh session per tap, loading event and student
+            # is request setup and is not counted
+            event = db_session.get(Event, event_id)
+            student = db_session.get(Student, student_id)
+            counter.reset()
+            mark(db_session, Attendance, event, student)
+            statements += counter.statements
+            commits += counter.commits
+            db_session.remove()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<7} {tap:<7} statements/tap={statements / students:.2f} "
+              f"commits/tap={commits / students:.2f} "
+              f"ms/tap={elapsed / students * 1000:.3f}")
+    counter.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries per request for marking attendance")
+    parser.add_argument("--students", type=int, default=500)
+    args = parser.parse_args()
+
+    use_temp_database()
+    run("legacy", legacy_mark, args.students)
+    run("record", record_mark, args.students)
+
+
+if __name__ == "__main__":
+    main()
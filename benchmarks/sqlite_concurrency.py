@@ -0,0 +1,119 @@
+"""
+Concurrent attendance writes against sqlite
+
+Runs writer threads marking attendance alongside reader threads loading
+the event's attendance, first with a plain sqlite engine (the previous
+create_engine(f"sqlite:///{path}")) and then with the engine built from
+settings (WAL, busy_timeout and the other SQLITE_PRAGMAS). Reports
+throughput and the rate of "database is locked" errors for each mode.
+
+    python -m benchmarks.sqlite_concurrency [--writers 8] [--readers 4] [--students 2000]
+"""
+from .common import use_temp_database, seed
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.exc import OperationalError
+
+from datetime import datetime
+import argparse
+import threading
+import time
+
+
+def writer(student_ids, event_id, stats):
+    from attendance.db import db_session
+    from attendance.models import Attendance, Student
+
+    for student_id in student_ids:
+        try:
+            # the student is loaded first, as on a request
+            db_session.get(Student, student_id)
+            Attendance.record_many(event_id, [(student_id, datetime.now())])
+            db_session.commit()
+            stats["writes"] += 1
+        except OperationalError as e:
+            db_session.rollback()
+            if "locked" not in str(e):
+                raise
+            stats["write_errors"] += 1
+    db_session.remove()
+
+
+def reader(event_id, stats, done):
+    from attendance.db import db_session
+    from attendance.models import Attendance
+
+    stmt = select(func.count()).select_from(Attendance).where(Attendance.event_id == event_id)
+    while not done.is_set():
+        try:
+            db_session.execute(stmt).scalar()
+            db_session.commit()
+            stats["reads"] += 1
+        except OperationalError as e:
+            db_session.rollback()
+            if "locked" not in str(e):
+                raise
+            stats["read_errors"] += 1
+    db_session.remove()
+
+
+def run(name, engine, args):
+    from attendance.db import Base, db_session
+
+    db_session.remove()
+    db_session.configure(bind=engine)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    event, rows = seed(db_session, args.students)
+    event_id, student_ids = event.id, [s.id for s in rows]
+    db_session.remove()
+
+    stats = {"writes": 0, "write_errors": 0, "reads": 0, "read_errors": 0}
+    done = threading.Event()
+    writers = [
+        threading.Thread(target=writer, args=(student_ids[n::args.writers], event_id, stats))
+        for n in range(args.writers)
+    ]
+    readers = [
+        threading.Thread(target=reader, args=(event_id, stats, done))
+        for _ in range(args.readers)
+    ]
+
+    start = time.perf_counter()
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    attempts = stats["writes"] + stats["write_errors"]
+    read_attempts = stats["reads"] + stats["read_errors"]
+    print(f"{name:<8} writes/s={stats['writes'] / elapsed:8.1f} "
+          f"write_lock_errors={stats['write_errors'] / attempts:6.2%} "
+          f"reads/s={stats['reads'] / elapsed:8.1f} "
+          f"read_lock_errors={stats['read_errors'] / max(read_attempts, 1):6.2%}")
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent attendance writes against sqlite")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=5.0,
+                        help="sqlite3 connect timeout in seconds for the default mode")
+    args = parser.parse_args()
+
+    path = use_temp_database()
+    from attendance import settings
+    from attendance.db import engine_from_config
+
+    run("default", create_engine(f"sqlite:///{path}", connect_args={"timeout": args.timeout}), args)
+    run("tuned", engine_from_config(vars(settings)), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Attendance taps per second, synchronous and write-behind
+
+Logs --students students in and has --clients threads tap
+/mark-attendance through the app, first with ATTENDANCE_WRITE_MODE =
+"sync" (a database commit per tap), then with "write-behind" (taps are
+recorded on the broker). For write-behind it then times the attendance
+writer saving the queue to the database and checks every tap was saved.
+
+    python -m benchmarks.write_behind [--students 2000] [--clients 8] [--broker redis]
+
+Runs on the in-process broker unless --broker redis is given.
+"""
+from .common import use_temp_database, seed
+
+import argparse
+import threading
+import time
+
+
+def tap(app, identities, stats):
+    client = app.test_client()
+    for identity in identities:
+        with client.session_transaction() as session:
+            session.clear()
+            session["student"] = identity
+        response = client.get("/mark-attendance", headers={"Referer": "/profile"})
+        stats["taps"] += response.status_code == 302
+    stats["done"] = True
+
+
+def run(app, mode, identities, clients):
+    app.config["ATTENDANCE_WRITE_MODE"] = mode
+    stats = [{"taps": 0} for _ in range(clients)]
+    threads = [
+        threading.Thread(target=tap, args=(app, identities[n::clients], stats[n]))
+        for n in range(clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    taps = sum(s["taps"] for s in stats)
+    print(f"{mode:<13} taps={taps} seconds={elapsed:.2f} taps/s={taps / elapsed:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attendance taps per second, synchronous and write-behind")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--broker", choices=["memory", "redis"], default="memory",
+                        help="redis uses the server configured in settings.py")
+    args = parser.parse_args()
+
+    use_temp_database()
+    from attendance import create_app
+    from attendance.db import Base, db_session
+    from attendance.events import invalidate_current_event
+    from attendance.feed import feed_key
+    from attendance.identity import student_identity
+    from attendance.models import Attendance
+    from attendance.writebehind import AttendanceWriter, QUEUE_KEY, marked_key
+
+    # every simulated student shares one address, so no rate limiting
+    app = create_app({"TESTING": True, "BROKER": args.broker, "RATE_LIMIT_ENABLED": False})
+    with app.app_context():
+        for mode in ("sync", "write-behind"):
+            engine = db_session.get_bind()
+            Base.metadata.drop_all(bind=engine)
+            Base.metadata.create_all(bind=engine)
+            event, students = seed(db_session, args.students)
+            event_id = event.id
+            identities = [student_identity(student) for student in students]
+            db_session.remove()
+            app.broker.delete(feed_key(event_id), marked_key(event_id), QUEUE_KEY)
+            invalidate_current_event()
+
+            run(app, mode, identities, args.clients)
+
+            if mode == "write-behind":
+                writer = AttendanceWriter(app, consumer="benchmark")
+                start = time.perf_counter()
+                saved = writer.flush()
+                elapsed = time.perf_counter() - start
+                saved_rows = db_session.query(Attendance).filter_by(event_id=event_id).count()
+                print(f"{'writer':<13} saved={saved} seconds={elapsed:.2f} "
+                      f"rows/s={saved / elapsed:.0f} rows_in_database={saved_rows}")
+            app.broker.delete(feed_key(event_id), marked_key(event_id), QUEUE_KEY)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# shared fixtures, every test gets a fresh sqlite database and an
+# in-process broker, so the suite needs no redis server
+
+from werkzeug.security import generate_password_hash
+import pytest
+
+from attendance import create_app
+from attendance.db import db_session, init_db
+from attendance.events import invalidate_current_event
+from attendance.models import Admin, Event, Student
+
+from datetime import datetime
+
+
+ADMIN_PASSWORD = "password1"
+
+
+@pytest.fixture
+def app_config():
+    """Config for the app fixture, override it in a module to change settings"""
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, app_config):
+    app = create_app({
+        "TESTING": True,
+        "SECRET_KEY": "test",
+        "DATABASE": tmp_path / "attendance.sqlite",
+        "BROKER": "memory",
+        "RATE_LIMIT_ENABLED": False,
+        **app_config,
+    })
+    with app.app_context():
+        init_db()
+        yield app
+        db_session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin(app):
+    admin = Admin("Ada", "Obi", "admin", generate_password_hash(ADMIN_PASSWORD))
+    db_session.add(admin)
+    db_session.commit()
+    return admin
+
+
+@pytest.fixture
+def admin_client(app, admin):
+    client = app.test_client()
+    client.post("/admin/login", data={"username": admin.username, "password": ADMIN_PASSWORD})
+    return client
+
+
+def make_student(n, **fields):
+    """Adds student number n, fields override the defaults"""
+    values = dict(
+        reg_num=f"2019/{100000 + n}", firstname="Chidi", lastname=f"Okafor{n}",
+        department="ECE", level="400", phone_number="08012345678",
+    )
+    values.update(fields)
+    student = Student(**values)
+    db_session.add(student)
+    return student
+
+
+def make_event(admin, date=None, closed=False):
+    """Adds an event created by admin, held now unless date is given"""
+    event = Event(date or datetime.now())
+    event.created_by = admin.id
+    event.closed = closed
+    db_session.add(event)
+    return event
+
+
+@pytest.fixture
+def event(app, admin):
+    """Today's class, open for attendance"""
+    event = make_event(admin)
+    db_session.commit()
+    # requests made so far may have cached that no class is open
+    invalidate_current_event()
+    return event
+
+
+@pytest.fixture
+def student(app):
+    student = make_student(1)
+    db_session.commit()
+    return student
+
+
+@pytest.fixture
+def student_client(app, student):
+    client = app.test_client()
+    client.post("/login", data={"reg_num": student.reg_num})
+    return client
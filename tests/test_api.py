@@ -0,0 +1,124 @@
+from attendance.db import db_session
+from attendance.feed import PUSH_RECORD_SCRIPT, feed_key, push_record_fallback
+from attendance.models import Attendance, StudentStats
+
+from conftest import make_event, make_student
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def token(app):
+    result = app.test_cli_runner().invoke(args=["create-api-token", "front-door"])
+    assert result.exit_code == 0, result.output
+    return result.output.split()[-1]
+
+
+@pytest.fixture
+def api(client, token):
+    """Calls the api as the front-door kiosk, api("get", "/events")"""
+    def call(method, path, **kwargs):
+        return getattr(client, method)(f"/api/v1{path}", headers={"Authorization": f"Bearer {token}"}, **kwargs)
+    return call
+
+
+@pytest.fixture
+def pushes(app):
+    """Arguments of each call to the feed push script"""
+    calls = []
+    script = app.broker.script(PUSH_RECORD_SCRIPT, push_record_fallback)
+
+    def counted(keys=(), args=()):
+        calls.append(args)
+        return script(keys=keys, args=args)
+    app.extensions["push_record_script"] = counted
+    return calls
+
+
+def test_a_token_is_required(app, client, token):
+    assert client.get("/api/v1/events").status_code == 401
+    response = client.get("/api/v1/events", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+
+
+def test_revoked_token_is_rejected_once_the_cache_expires(app, api):
+    assert api("get", "/events").status_code == 200
+    app.test_cli_runner().invoke(args=["revoke-api-token", "front-door"])
+    assert api("get", "/events").status_code == 200
+    app.extensions["api_tokens"].clear()
+    assert api("get", "/events").status_code == 401
+
+
+def test_mark_one_student(app, api, event, student, pushes):
+    reg_num = student.reg_num
+    response = api("post", "/attendance", json={"reg_num": reg_num})
+    assert response.status_code == 201
+    assert response.get_json()["status"] == "taken"
+    response = api("post", "/attendance", json={"reg_num": reg_num})
+    assert (response.status_code, response.get_json()["status"]) == (200, "already_taken")
+    assert len(pushes) == 1
+
+
+def test_mark_needs_an_open_class(app, api, student):
+    response = api("post", "/attendance", json={"reg_num": student.reg_num})
+    assert response.status_code == 409
+
+
+@pytest.mark.parametrize("body", [["2019/123456"], {"reg_num": 5}, {"reg_num": None}, "2019/123456"])
+def test_mark_rejects_a_malformed_body(app, api, event, body):
+    response = api("post", "/attendance", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_batch(app, api, event, pushes):
+    students = [make_student(n) for n in range(3)]
+    db_session.commit()
+    reg_nums = [student.reg_num for student in students]
+    arrived = (datetime.now() - timedelta(minutes=5)).replace(microsecond=0)
+    taps = [
+        reg_nums[0],
+        {"reg_num": reg_nums[1], "arrival_time": arrived.isoformat()},
+        reg_nums[1],
+        "2019/999999",
+        "not a reg_num",
+        {"reg_num": reg_nums[2], "arrival_time": (datetime.now() + timedelta(hours=1)).isoformat()},
+        {"reg_num": reg_nums[2], "arrival_time": 1700000000},
+        {"reg_num": 5},
+        42,
+    ]
+    response = api("post", "/attendance/batch", json={"event_id": event.id, "taps": taps})
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body["taken"], body["already_taken"], body["unknown"]) == (2, 0, ["2019/999999"])
+    assert len(body["invalid"]) == 5
+
+    # the earliest tap of a student counts
+    attendance = db_session.get(Attendance, (event.id, students[1].id))
+    assert attendance.arrival_time == arrived
+    assert db_session.get(StudentStats, students[1].id).attended == 1
+    # the records were pushed to the feed in one call
+    assert len(pushes) == 1 and len(pushes[0]) == 2 + 2
+    assert app.broker.xlen(feed_key(event.id)) == 2
+
+    response = api("post", "/attendance/batch", json={"taps": reg_nums})
+    assert (response.get_json()["taken"], response.get_json()["already_taken"]) == (1, 2)
+
+
+def test_batch_is_only_for_todays_class(app, api, admin, event, student):
+    earlier = make_event(admin, date=datetime.now() - timedelta(days=1))
+    db_session.commit()
+    taps = [student.reg_num]
+    assert api("post", "/attendance/batch", json={"event_id": earlier.id, "taps": taps}).status_code == 409
+    assert api("post", "/attendance/batch", json={"event_id": 999, "taps": taps}).status_code == 404
+    assert api("post", "/attendance/batch", json={"event_id": "1", "taps": taps}).status_code == 400
+    assert api("post", "/attendance/batch", json={"taps": "nope"}).status_code == 400
+
+
+def test_batch_size_is_capped(app, api, event):
+    app.config["API_BATCH_SIZE"] = 2
+    response = api("post", "/attendance/batch", json={"taps": ["2019/000001"] * 3})
+    assert response.status_code == 413
+
@@ -0,0 +1,68 @@
+from attendance.broker import Broker, MemoryBroker, RedisBroker
+
+import pytest
+import time
+
+
+@pytest.fixture(params=["memory", "redis"])
+def broker(request):
+    if request.param == "memory":
+        return MemoryBroker()
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisBroker(fakeredis.FakeRedis())
+
+
+def test_brokers_implement_the_interface():
+    with pytest.raises(TypeError):
+        Broker()
+    for broker_class in (MemoryBroker, RedisBroker):
+        assert not broker_class.__abstractmethods__
+
+
+def test_key_value(broker):
+    assert broker.set("a", 1)
+    assert not broker.set("a", 2, nx=True)
+    assert broker.get("a") == b"1"
+    broker.set_many({"b": "x", "c": "y"})
+    assert broker.mget(["a", "b", "missing"]) == [b"1", b"x", None]
+    assert broker.incr("n", 2) == 2 and broker.incr("n") == 3
+    broker.rename("b", "d")
+    assert (broker.exists("b"), broker.exists("d")) == (0, 1)
+    assert broker.delete("a", "d", "missing") == 2
+
+
+def test_expiry(broker):
+    broker.set("short", 1, px=50)
+    broker.sadd("members", "x")
+    assert broker.expire("members", 1)
+    time.sleep(0.1)
+    assert broker.get("short") is None
+    assert broker.sismember("members", "x")
+
+
+def test_consumer_group(broker):
+    broker.group_create("queue", "writers")
+    ids = [broker.xadd("queue", {"n": n}) for n in range(3)]
+    assert broker.xlen("queue") == 3
+
+    first = broker.group_read("queue", "writers", "a", ">", count=2)
+    assert [entry_id for entry_id, _ in first] == ids[:2]
+    # read but not acknowledged, replayed to the same consumer
+    assert broker.group_read("queue", "writers", "a", "0") == first
+    broker.group_ack("queue", "writers", [ids[0]])
+
+    _, claimed = broker.group_claim("queue", "writers", "b", 0)
+    assert [entry_id for entry_id, _ in claimed] == [ids[1]]
+    assert [entry_id for entry_id, _ in broker.group_read("queue", "writers", "b", ">")] == [ids[2]]
+
+
+def test_memory_broker_sweeps_expired_keys():
+    broker = MemoryBroker()
+    broker.sweep_interval = 0
+    for n in range(100):
+        broker.set(f"ratelimit:ip:{n}", 1, px=1)
+    time.sleep(0.01)
+    # never read again, dropped by the next write
+    broker.set("other", 1)
+    assert list(broker._data) == [b"other"]
+    assert not broker._expires
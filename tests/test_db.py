@@ -0,0 +1,27 @@
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool, SingletonThreadPool
+
+from attendance.db import make_engine, decode_cursor, encode_cursor
+
+import pytest
+
+
+def test_file_sqlite_engine_is_pooled(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'a.sqlite'}", pool_size=3, sqlite_pragmas={"journal_mode": "WAL"})
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 3
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+
+
+def test_memory_sqlite_engine_takes_no_pool_settings():
+    engine = make_engine("sqlite://", pool_size=3, max_overflow=1, pool_timeout=1)
+    assert isinstance(engine.pool, SingletonThreadPool)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("2023-05-01T09:00:00", 7)) == ["2023-05-01T09:00:00", 7]
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
@@ -0,0 +1,43 @@
+from attendance import create_app
+from attendance.db import db_session
+from attendance.events import get_current_event, invalidate_current_event, close_event
+
+from conftest import make_event
+
+from datetime import datetime, timedelta
+
+
+def test_current_event_is_cached(app, admin):
+    assert get_current_event() is None
+    event = make_event(admin)
+    db_session.commit()
+    # the negative result is still cached
+    assert get_current_event() is None
+
+    invalidate_current_event()
+    assert get_current_event().id == event.id
+
+
+def test_later_event_of_the_day_is_not_current(app, admin):
+    make_event(admin, date=datetime.now() + timedelta(minutes=5))
+    db_session.commit()
+    assert get_current_event() is None
+
+
+def test_closed_event_is_not_current(app, admin):
+    event = make_event(admin)
+    db_session.commit()
+    assert get_current_event().id == event.id
+
+    close_event(event)
+    assert get_current_event() is None
+
+
+def test_apps_do_not_share_the_cache(app, admin, tmp_path):
+    event = make_event(admin)
+    db_session.commit()
+    assert get_current_event().id == event.id
+
+    other = create_app({"TESTING": True, "DATABASE": tmp_path / "other.sqlite", "BROKER": "memory"})
+    assert "current_event" not in other.extensions
+    assert app.extensions["current_event"][2]["id"] == event.id
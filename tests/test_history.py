@@ -0,0 +1,157 @@
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import WriteOnlyCollection
+
+from attendance.db import db_session, encode_cursor
+from attendance.history import attendance_page, event_page
+from attendance.models import Attendance
+
+from conftest import make_event, make_student
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def app_config():
+    return {"ADMIN_PAGE_SIZE": 2}
+
+
+@pytest.fixture
+def events(app, admin):
+    # two classes share each date, the id breaks the tie
+    day = datetime(2023, 1, 2, 9)
+    events = [make_event(admin, day + timedelta(days=n // 2)) for n in range(7)]
+    db_session.commit()
+    return events
+
+
+@pytest.fixture
+def arrivals(app, event):
+    # three students arrive at each time, the student id breaks the tie
+    students = [make_student(n) for n in range(7)]
+    db_session.commit()
+    start = datetime.now().replace(microsecond=0)
+    Attendance.record_many(event.id, [
+        (student.id, start + timedelta(minutes=n // 3)) for n, student in enumerate(students)
+    ])
+    db_session.commit()
+    return students
+
+
+def read_all(page, limit):
+    rows, cursor, pages = [], None, 0
+    while True:
+        page_rows, cursor = page(cursor, limit)
+        rows += page_rows
+        pages += 1
+        if cursor is None:
+            return rows, pages
+
+
+def test_event_pages_have_no_duplicates_or_gaps(events):
+    expected = sorted(events, key=lambda event: (event.date, event.id), reverse=True)
+    for limit in (1, 2, 3, 7, 50):
+        rows, pages = read_all(event_page, limit)
+        assert [event.id for event in rows] == [event.id for event in expected]
+        assert pages == max(1, -(-len(events) // limit))
+
+
+def test_collections_are_never_loaded_whole(event, student):
+    # an event's attendance and a student's history are read page by page
+    assert isinstance(event.attendance, WriteOnlyCollection)
+    assert isinstance(student.events, WriteOnlyCollection)
+
+
+def test_event_page_counts_attendance(event, arrivals):
+    (page, cursor) = event_page()
+    assert cursor is None
+    assert [e.attendance_count for e in page] == [len(arrivals)]
+
+
+def test_attendance_pages_have_no_duplicates_or_gaps(event, arrivals):
+    for limit in (1, 2, 3, 50):
+        rows, _ = read_all(lambda cursor, limit: attendance_page(event.id, cursor, limit), limit)
+        assert [row.student_id for row in rows] == [student.id for student in arrivals]
+        assert [row.student.reg_num for row in rows] == [student.reg_num for student in arrivals]
+
+
+@pytest.mark.parametrize("cursor", ["junk", encode_cursor("not a date", 1), encode_cursor(datetime.now().isoformat(), "x")])
+def test_bad_cursor_is_rejected(event, cursor):
+    with pytest.raises(ValueError):
+        event_page(cursor)
+    with pytest.raises(ValueError):
+        attendance_page(event.id, cursor)
+
+
+def test_pages_seek_their_index(event, arrivals):
+    # every page after the first starts at the cursor, not the first row
+    statements = []
+
+    def grab(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = db_session.get_bind()
+    sa_event.listen(engine, "before_cursor_execute", grab)
+    try:
+        cursor = encode_cursor(datetime.now().isoformat(), 1)
+        event_page(cursor, 2)
+        attendance_page(event.id, cursor, 2)
+    finally:
+        sa_event.remove(engine, "before_cursor_execute", grab)
+
+    connection = db_session.connection().connection.driver_connection
+    plan = [
+        row[-1]
+        for statement, parameters in statements
+        for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    ]
+    assert "SEARCH event USING INDEX ix_event_date_id (date<?)" in plan
+    assert "SEARCH attendance USING COVERING INDEX ix_attendance_event_arrival (event_id=? AND arrival_time>?)" in plan
+    assert not any("TEMP B-TREE" in detail for detail in plan)
+
+
+def test_admin_pages(admin_client, events):
+    response = admin_client.get("/admin/events")
+    assert response.status_code == 200
+    assert b'hx-trigger="revealed"' in response.data
+    cursor = event_page(None, 2)[1]
+
+    response = admin_client.get(f"/admin/events?cursor={cursor}", headers={"HX-Request": "true"})
+    assert response.status_code == 200
+    assert b"<html" not in response.data
+    assert response.data.count(b'class="table-row"') == 3  # 2 events and the next page loader
+
+    response = admin_client.get("/admin/events?cursor=junk")
+    assert response.status_code == 302
+
+
+def test_admin_attendance_pages(admin_client, event, arrivals):
+    response = admin_client.get(f"/admin/events/{event.id}")
+    assert response.status_code == 200
+    assert arrivals[0].reg_num.encode() in response.data
+    assert arrivals[2].reg_num.encode() not in response.data
+
+    response = admin_client.get(f"/admin/events/{event.id + 1}")
+    assert response.status_code == 302
+
+
+def test_api_pages(app, event, arrivals):
+    token = app.test_cli_runner().invoke(args=["create-api-token", "front-door"]).output.split()[-1]
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    reg_nums, cursor = [], None
+    while True:
+        query = f"?limit=3&cursor={cursor}" if cursor else "?limit=3"
+        response = client.get(f"/api/v1/events/{event.id}/attendance{query}", headers=headers)
+        assert response.status_code == 200
+        body = response.get_json()
+        reg_nums += [row["reg_num"] for row in body["attendance"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert reg_nums == [student.reg_num for student in arrivals]
+
+    response = client.get("/api/v1/events?cursor=junk", headers=headers)
+    assert response.status_code == 400
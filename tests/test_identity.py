@@ -0,0 +1,47 @@
+from sqlalchemy import delete
+
+from attendance.db import db_session
+from attendance.identity import Identity, IdentityGone, logged_out
+from attendance.models import Admin, Student
+
+import flask
+import pytest
+
+
+def test_session_fields_need_no_query(app):
+    identity = Identity(Student, {'id': 42, 'firstname': "Chidi"})
+    assert identity.firstname == "Chidi"
+
+
+def test_other_fields_load_the_row(app, student):
+    identity = Identity(Student, {'id': student.id})
+    assert identity.to_json(mask=[]) == student.to_json(mask=[])
+
+
+def test_deleted_row_raises(app):
+    with pytest.raises(IdentityGone):
+        Identity(Student, {'id': 42}).phone_number
+
+
+def test_deleted_student_is_logged_out(app, student, student_client):
+    student_id, reg_num = student.id, student.reg_num
+    db_session.execute(delete(Student).where(Student.id == student_id))
+    db_session.commit()
+
+    form = dict(
+        reg_num=reg_num, firstname="Ngozi", lastname="Okafor",
+        department="ECE", level="400", phone_number="08012345678",
+    )
+    response = student_client.post("/edit", data=form)
+    assert response.status_code == 302
+    assert response.location == "/login"
+    with student_client.session_transaction() as session:
+        assert "student" not in session
+
+
+def test_deleted_admin_is_logged_out(app):
+    with app.test_request_context("/admin/"):
+        flask.session["admin"] = {'id': 42}
+        response = logged_out(IdentityGone(Admin))
+        assert response.location == "/admin/login"
+        assert "admin" not in flask.session
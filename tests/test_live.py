@@ -0,0 +1,98 @@
+from attendance.db import db_session
+from attendance.feed import AttendanceRecord, push_record
+
+from conftest import make_student
+
+from datetime import datetime
+import subprocess
+import sys
+
+
+def push(event, student):
+    record = AttendanceRecord.for_student(student, datetime.now()).to_bytes()
+    return push_record(event.id, record)
+
+
+def test_sse_mode_does_not_load_socketio(tmp_path):
+    # a fresh interpreter, other tests may have imported it already
+    code = (
+        "import sys\n"
+        "from attendance import create_app\n"
+        f"app = create_app({{'TESTING': True, 'BROKER': 'memory', 'DATABASE': {str(tmp_path / 'a.sqlite')!r}}})\n"
+        "import attendance.admin\n"
+        "assert 'flask_socketio' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_live_page_lists_records(app, event, admin_client):
+    student = make_student(1)
+    db_session.commit()
+    push(event, student)
+
+    response = admin_client.get("/admin/live-attendance")
+    assert response.status_code == 200
+    assert student.reg_num.encode() in response.data
+
+
+def test_rows_page_older_records(app, event, admin_client):
+    app.config["FEED_PAGE_SIZE"] = 2
+    students = [make_student(n) for n in range(3)]
+    db_session.commit()
+    reg_nums = [student.reg_num.encode() for student in students]
+    for student in students:
+        push(event, student)
+
+    first = admin_client.get("/admin/live-attendance")
+    assert reg_nums[2] in first.data and reg_nums[0] not in first.data
+    before = first.data.split(b"before=")[1].split(b'"')[0].decode()
+
+    older = admin_client.get(f"/admin/live-attendance/rows?before={before}")
+    assert older.status_code == 200
+    assert reg_nums[0] in older.data and reg_nums[2] not in older.data
+
+
+def test_rows_reject_a_bad_cursor(app, event, admin_client):
+    response = admin_client.get("/admin/live-attendance/rows?before=garbage")
+    assert response.status_code == 400
+
+
+def read_frames(response, count):
+    frames = []
+    for chunk in response.response:
+        frames.append(chunk.decode() if isinstance(chunk, bytes) else chunk)
+        if len(frames) == count:
+            break
+    response.close()
+    return frames
+
+
+def test_stream_replays_records_after_last_event_id(app, event, admin_client):
+    students = [make_student(n) for n in range(3)]
+    db_session.commit()
+    reg_nums = [student.reg_num for student in students]
+    first_id = push(event, students[0])
+    for student in students[1:]:
+        push(event, student)
+
+    response = admin_client.get(
+        "/admin/live-attendance-update",
+        headers={"Last-Event-ID": first_id},
+        buffered=False,
+    )
+    opening, replay = read_frames(response, 2)
+    assert opening.startswith("retry:")
+    assert "event:new_attendance_batch" in replay
+    assert reg_nums[0] not in replay
+    assert reg_nums[1] in replay and reg_nums[2] in replay
+
+
+def test_stream_ignores_an_unknown_last_event_id(app, event, admin_client):
+    app.config["SSE_HEARTBEAT_INTERVAL"] = 0.01
+    response = admin_client.get(
+        "/admin/live-attendance-update",
+        headers={"Last-Event-ID": "garbage"},
+        buffered=False,
+    )
+    opening, heartbeat = read_frames(response, 2)
+    assert heartbeat == ": heartbeat\n\n"
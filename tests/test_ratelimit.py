@@ -0,0 +1,71 @@
+from sqlalchemy import event as sa_event
+
+from attendance import db
+from attendance.ratelimit import take_token
+
+import pytest
+import time
+
+
+@pytest.fixture
+def app_config():
+    return {
+        "RATE_LIMIT_ENABLED": True,
+        "RATE_LIMIT_STUDENT": (1, 3),
+        "RATE_LIMIT_IP": (1, 5),
+    }
+
+
+@pytest.fixture
+def statements(app):
+    """Counts the SQL statements run while the test runs"""
+    count = [0]
+
+    def count_statement(*args):
+        count[0] += 1
+    sa_event.listen(db.engine, "before_cursor_execute", count_statement)
+    yield count
+    sa_event.remove(db.engine, "before_cursor_execute", count_statement)
+
+
+def test_bucket_refills(app):
+    bucket = [("bucket", (100, 2))]
+    assert take_token(bucket) == 0
+    assert take_token(bucket) == 0
+    assert take_token(bucket) > 0
+    time.sleep(0.02)
+    assert take_token(bucket) == 0
+
+
+def test_a_token_is_taken_only_when_every_bucket_has_one(app):
+    assert take_token([("a", (0.001, 1)), ("b", (0.001, 2))]) == 0
+    assert take_token([("a", (0.001, 1)), ("b", (0.001, 2))]) > 0
+    # the refused request did not use up b's second token
+    assert take_token([("b", (0.001, 2))]) == 0
+
+
+def test_student_is_limited(app, student_client):
+    # logging in took a token from the ip bucket only
+    statuses = [student_client.get("/profile").status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    response = student_client.get("/profile")
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_client_ip_is_limited(app, client):
+    statuses = [client.get("/login").status_code for _ in range(6)]
+    assert statuses == [200] * 5 + [429]
+    # other clients behind the same address share the bucket
+    assert app.test_client().get("/login").status_code == 429
+
+
+def test_admin_pages_are_not_limited(app, admin_client):
+    assert {admin_client.get("/admin/").status_code for _ in range(10)} == {200}
+
+
+def test_repeat_tap_runs_no_sql(app, event, student_client, statements):
+    assert student_client.get("/mark-attendance").status_code == 302
+    statements[0] = 0
+    response = student_client.get("/mark-attendance")
+    assert response.status_code == 302
+    assert statements[0] == 0
@@ -0,0 +1,100 @@
+from sqlalchemy import select
+
+from attendance import roster
+from attendance.db import db_session
+from attendance.models import Student
+from attendance.roster import import_students
+
+from conftest import make_student
+
+import io
+
+
+HEADER = "reg_num,firstname,lastname,department,level,phone_number\r\n"
+
+
+def roster_file(*rows):
+    return io.StringIO(HEADER + "".join(row + "\r\n" for row in rows), newline="")
+
+
+def reg_nums():
+    return set(db_session.execute(select(Student.reg_num)).scalars())
+
+
+def test_import_reports_invalid_and_duplicate_rows(app):
+    make_student(1, reg_num="2019/000001")
+    db_session.commit()
+    report = import_students(roster_file(
+        "2019/000001,Ada,Obi,ECE,400,",
+        "2019/000002,Ada,Obi,ECE,400,08012345678",
+        "2019/000002,Ada,Obi,ECE,400,",
+        "2019/000003,Ada,Obi,ECE,450,",
+        "2019/000004,Ada,Obi,ECE,100,",
+    ), batch_size=2)
+
+    assert (report.rows, report.imported, report.duplicates, report.invalid) == (5, 2, 2, 1)
+    assert [line for line, _, _ in report.errors] == [2, 4, 5]
+    assert reg_nums() == {"2019/000001", "2019/000002", "2019/000004"}
+
+
+def test_import_rejects_a_roster_without_required_columns(app):
+    try:
+        import_students(io.StringIO("reg_num,firstname\n"))
+    except ValueError as e:
+        assert "lastname" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
+
+
+def test_student_enrolled_during_import_is_reported(app, monkeypatch):
+    make_student(1, reg_num="2019/000001")
+    db_session.commit()
+    # the enrolled check misses a student who enrolls after it
+    monkeypatch.setattr(roster, "_enrolled", lambda reg_nums: set())
+
+    report = import_students(roster_file(
+        "2019/000001,Ada,Obi,ECE,400,",
+        "2019/000002,Ada,Obi,ECE,400,",
+    ))
+    assert (report.imported, report.duplicates) == (1, 1)
+    assert report.errors == [(2, "2019/000001", "already enrolled")]
+    assert reg_nums() == {"2019/000001", "2019/000002"}
+
+
+def test_admin_upload(app, admin_client):
+    data = HEADER + "2019/000001,Ada,Obi,ECE,400,\r\n2019/000002,Ada,Obi,ECE,401,\r\n"
+    response = admin_client.post(
+        "/admin/students/import",
+        data={"roster": (io.BytesIO(data.encode()), "roster.csv")},
+    )
+    assert response.status_code == 200
+    assert b"1 students imported" in response.data
+    assert reg_nums() == {"2019/000001"}
+
+
+def test_cli_reads_quoted_fields_spanning_lines(app, tmp_path):
+    path = tmp_path / "roster.csv"
+    path.write_bytes((HEADER + '2019/000001,Ada,"Obi\r\nJr",ECE,400,\r\n').encode())
+
+    result = app.test_cli_runner().invoke(args=["import-students", str(path)])
+    assert result.exit_code == 0, result.output
+    assert "1 students imported" in result.output
+    student = db_session.execute(select(Student)).scalar_one()
+    assert student.lastname == "Obi\r\nJr"
+
+
+def test_cli_batch_size_defaults_to_the_setting(app, tmp_path, monkeypatch):
+    sizes = []
+
+    def spy(fileobj, batch_size):
+        sizes.append(batch_size)
+        return import_students(fileobj, batch_size=batch_size)
+    monkeypatch.setattr("attendance.commands.import_students", spy)
+    app.config["IMPORT_BATCH_SIZE"] = 7
+    path = tmp_path / "roster.csv"
+    path.write_bytes((HEADER + "2019/000001,Ada,Obi,ECE,400,\r\n").encode())
+
+    runner = app.test_cli_runner()
+    assert runner.invoke(args=["import-students", str(path)]).exit_code == 0
+    assert runner.invoke(args=["import-students", "--batch-size", "3", str(path)]).exit_code == 0
+    assert sizes == [7, 3]
@@ -0,0 +1,71 @@
+from attendance.db import db_session
+from attendance.models import Student
+from attendance.validation import STUDENT_SCHEMA
+
+from conftest import make_student
+
+import pytest
+
+
+FORM = dict(
+    reg_num="2019/123456", firstname="Ada", lastname="Obi",
+    department="ECE", level="400", phone_number="08012345678",
+)
+
+
+def students():
+    db_session.expire_all()
+    return Student.query.order_by(Student.id).all()
+
+
+def test_enroll_stores_cleaned_values(app, client):
+    form = {name: f"  {value} " for name, value in FORM.items()}
+    form["csrf_token"] = "ignored"
+    response = client.post("/enroll", data=form)
+    assert response.location == "/profile"
+
+    student, = students()
+    assert (student.reg_num, student.firstname, student.level) == ("2019/123456", "Ada", 400)
+
+
+def test_enroll_rejects_invalid_and_duplicate_students(app, client, student):
+    client.post("/enroll", data=dict(FORM, level="450"))
+    client.post("/enroll", data=dict(FORM, reg_num=student.reg_num))
+    assert len(students()) == 1
+
+
+def test_edit_profile_stores_cleaned_values(app, student, student_client):
+    student_id = student.id
+    form = dict(FORM, firstname="  Ngozi  ", id="99", created_by="1")
+    response = student_client.post("/edit", data=form)
+    assert response.location == "/profile"
+
+    student, = students()
+    assert (student.id, student.firstname, student.reg_num) == (student_id, "Ngozi", "2019/123456")
+    with student_client.session_transaction() as session:
+        assert session["student"]["firstname"] == "Ngozi"
+
+
+def test_edit_profile_keeps_reg_nums_unique(app, student, student_client):
+    other = make_student(2)
+    db_session.commit()
+    taken = other.reg_num
+    response = student_client.post("/edit", data=dict(FORM, reg_num=taken))
+    assert response.location == "/edit"
+    assert [s.reg_num for s in students()].count(taken) == 1
+
+
+@pytest.mark.parametrize("name, value", [
+    ("reg_num", 2019123456), ("reg_num", ["2019/123456"]), ("phone_number", 8012345678),
+    ("firstname", {"name": "Ada"}), ("level", True), ("level", 400.0),
+])
+def test_schema_rejects_values_of_the_wrong_type(name, value):
+    with pytest.raises(ValueError, match=f"{name} must be"):
+        STUDENT_SCHEMA.check(name, value)
+    values, errors = STUDENT_SCHEMA.validate(dict(FORM, **{name: value}))
+    assert name not in values and len(errors) == 1
+
+
+def test_schema_takes_a_numeric_level():
+    assert STUDENT_SCHEMA.check("level", 400) == 400
+    assert STUDENT_SCHEMA.check("level", " 400 ") == 400
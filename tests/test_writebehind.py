@@ -0,0 +1,122 @@
+from attendance.analytics import event_summaries, summary_key
+from attendance.broker import RedisBroker
+from attendance.db import db_session
+from attendance.feed import feed_key
+from attendance.events import close_event
+from attendance.models import Attendance, StudentStats
+from attendance.register import take_attendance
+from attendance.writebehind import AttendanceWriter, QUEUE_KEY, is_marked
+
+from conftest import make_event, make_student
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def write_behind(app):
+    app.config["ATTENDANCE_WRITE_MODE"] = "write-behind"
+
+
+def tap_all(event, students):
+    return take_attendance(event.id, [(student, datetime.now()) for student in students])
+
+
+def streaks(students):
+    return [
+        (stats.attended, stats.current_streak, stats.longest_streak)
+        for stats in (db_session.get(StudentStats, student.id) for student in students)
+    ]
+
+
+def test_taps_are_queued_until_saved(app, write_behind, event):
+    students = [make_student(n) for n in range(3)]
+    db_session.commit()
+
+    assert len(tap_all(event, students)) == 3
+    # repeat taps are rejected by the marked set
+    assert tap_all(event, students[:1]) == []
+    assert is_marked(event.id, students[0].id)
+    assert Attendance.query.count() == 0
+
+    assert AttendanceWriter(app, consumer="test").flush() == 3
+    assert Attendance.query.count() == 3
+    assert app.broker.xlen(QUEUE_KEY) == 0
+    assert streaks(students) == [(1, 1, 1)] * 3
+
+
+@pytest.mark.parametrize("broker", ["memory", "redis"])
+def test_a_batch_is_queued_in_one_call(app, write_behind, event, broker):
+    if broker == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        app.broker = RedisBroker(fakeredis.FakeRedis())
+    students = [make_student(n) for n in range(4)]
+    db_session.commit()
+    calls = []
+    register = app.broker.script
+
+    def counted(source, fallback):
+        script = register(source, fallback)
+        return lambda keys=(), args=(): calls.append(args) or script(keys=keys, args=args)
+    app.broker.script = counted
+
+    assert tap_all(event, students[:3]) == students[:3]
+    assert tap_all(event, students) == students[3:]
+    assert len(calls) == 2
+    assert app.broker.xlen(QUEUE_KEY) == 4
+    assert app.broker.xlen(feed_key(event.id)) == 4
+    assert AttendanceWriter(app, consumer="test").flush() == 4
+
+
+def test_replayed_batch_is_saved_once(app, write_behind, event):
+    students = [make_student(n) for n in range(2)]
+    db_session.commit()
+    tap_all(event, students)
+
+    writer = AttendanceWriter(app, consumer="test")
+    writer.replay()
+    entries = writer._read(">")
+    assert writer.save(entries) == 2
+    # a writer that crashed before acknowledging saves the batch again
+    assert writer.save(entries) == 0
+    assert streaks(students) == [(1, 1, 1)] * 2
+
+
+def test_close_saves_queued_taps_first(app, write_behind, admin):
+    students = [make_student(n) for n in range(3)]
+    first = make_event(admin, date=datetime.now() - timedelta(days=1))
+    second = make_event(admin)
+    db_session.commit()
+
+    for event in (first, second):
+        tap_all(event, students)
+        close_event(event)
+
+    assert streaks(students) == [(2, 2, 2)] * 3
+    assert [summary['total'] for summary in event_summaries([first, second])] == [3, 3]
+
+
+def test_batch_saved_after_close_is_recounted(app, write_behind, admin):
+    students = [make_student(n) for n in range(3)]
+    first = make_event(admin, date=datetime.now() - timedelta(days=1))
+    second = make_event(admin)
+    db_session.commit()
+    tap_all(first, students)
+    close_event(first)
+
+    tap_all(second, students)
+    # another writer has read the taps but not saved them yet,
+    # the close cannot see them
+    busy = AttendanceWriter(app, consumer="busy")
+    busy.replay()
+    entries = busy._read(">")
+    close_event(second)
+    assert streaks(students) == [(1, 0, 1)] * 3
+    assert event_summaries([second])[0]['total'] == 0
+    assert app.broker.get(summary_key(second.id)) is not None
+
+    busy.save(entries)
+    assert streaks(students) == [(2, 2, 2)] * 3
+    assert app.broker.get(summary_key(second.id)) is None
+    assert event_summaries([second])[0]['total'] == 3